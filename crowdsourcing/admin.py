@@ -8,14 +8,15 @@ from django.forms import ModelForm, ValidationError
 from django.forms.widgets import Select
 from django.utils.translation import ugettext_lazy as _
 
-from .models import (Question, Survey, Answer, Submission,
+from .caching import bump_survey_version
+from .models import (Question, Survey, Answer, Submission, FlickrUpload,
                      SurveyReport, SurveyReportDisplay, OPTION_TYPE_CHOICES,
                      SURVEY_DISPLAY_TYPE_CHOICES,
                      SURVEY_AGGREGATE_TYPE_CHOICES, FORMAT_CHOICES)
 
 
 try:
-    from .flickrsupport import get_group_names, get_group_id
+    from .flickrsupport import flickr_available, get_group_names, get_group_id
 except ImportError:
     get_group_names = None
 
@@ -60,7 +61,7 @@ class QuestionInline(admin.StackedInline):
 
 def _flickr_group_choices():
     blank = [('', '------',)]
-    if get_group_names:
+    if get_group_names and flickr_available():
         return blank + [(n, n,) for n in get_group_names()]
     return blank
 
@@ -78,7 +79,7 @@ class SurveyAdminForm(ModelForm):
     def clean_flickr_group_name(self):
         group = self.cleaned_data.get('flickr_group_name', "")
         if group:
-            if not get_group_names:
+            if not (get_group_names and flickr_available()):
                 raise ValidationError(
                     _("Flickr support is broken. Contact a programmer."))
             elif not get_group_id(group):
@@ -116,6 +117,9 @@ class SurveyAdmin(admin.ModelAdmin):
         'ends_at',
         'is_published',
         'site',
+        'submission_count',
+        'public_submission_count',
+        'last_submitted_at',
         submissions_as)
     list_filter = ('survey_date', 'is_published', 'site')
     date_hierarchy = 'survey_date'
@@ -141,10 +145,28 @@ class SubmissionAdmin(admin.ModelAdmin):
     date_hierarchy = 'submitted_at'
     inlines = [AnswerInline]
 
+    def save_formset(self, request, form, formset, change):
+        super(SubmissionAdmin, self).save_formset(request,
+                                                  form,
+                                                  formset,
+                                                  change)
+        # Saving answers doesn't bump the results version on its own.
+        bump_survey_version(form.instance.survey_id)
+
 
 admin.site.register(Submission, SubmissionAdmin)
 
 
+class FlickrUploadAdmin(admin.ModelAdmin):
+    raw_id_fields = ('answer',)
+    list_display = ('answer', 'queued_at', 'attempts', 'next_attempt_at')
+    readonly_fields = ('last_error',)
+    date_hierarchy = 'queued_at'
+
+
+admin.site.register(FlickrUpload, FlickrUploadAdmin)
+
+
 SDTC = SURVEY_DISPLAY_TYPE_CHOICES
 TEXT = SDTC.TEXT
 PIE = SDTC.PIE
@@ -0,0 +1,64 @@
+"""
+Cached survey results are keyed by a per-survey version number rather than
+deleted when a survey changes. Bumping the version orphans every key built
+from the old one and the cache expires them on its own. Versions are
+millisecond timestamps, so a version that falls out of the cache comes back
+larger than any version it could have replaced.
+"""
+from __future__ import absolute_import
+
+import hashlib
+import time
+
+from django.core.cache import cache
+
+
+# memcached won't hold anything longer than 30 days.
+VERSION_TIMEOUT = 30 * 24 * 60 * 60
+
+
+def _version_key(survey_id, kind):
+    return "crowdsourcing_%s_version_%s" % (kind, survey_id)
+
+
+def _now():
+    return int(time.time() * 1000)
+
+
+def get_version(key):
+    version = cache.get(key, None)
+    if version is None:
+        cache.add(key, _now(), VERSION_TIMEOUT)
+        version = cache.get(key, None) or _now()
+    return version
+
+
+def bump_version(key):
+    version = max(_now(), (cache.get(key, None) or 0) + 1)
+    cache.set(key, version, VERSION_TIMEOUT)
+    return version
+
+
+def get_survey_version(survey_id, kind="results"):
+    """ kind separates things that change at different rates. "results"
+    changes with every submission. """
+    return get_version(_version_key(survey_id, kind))
+
+
+def bump_survey_version(survey_id, kind="results"):
+    return bump_version(_version_key(survey_id, kind))
+
+
+# Changes whenever a Site changes.
+SITES_VERSION_KEY = "crowdsourcing_sites_version"
+
+# Changes whenever a survey turns its wide table on or off, or the table
+# changes state.
+WIDE_TABLES_VERSION_KEY = "crowdsourcing_wide_tables_version"
+
+
+def make_key(prefix, *parts):
+    """ parts can be anything with a stable repr. We hash them because
+    memcached doesn't allow long keys or keys with spaces. """
+    digest = hashlib.md5(repr(parts)).hexdigest()
+    return "crowdsourcing_%s_%s" % (prefix, digest)
@@ -7,34 +7,54 @@ from urllib2 import URLError
 
 from django.core.cache import cache
 
-import flickrapi
-import hashlib
+try:
+    import flickrapi
+except ImportError:
+    logging.warn('no flickr support available')
+    flickrapi = None
 
 from . import settings as local_settings
+from .util import get_function, get_photo_hash
 
 
 _flickr = None
 
 
 def _has_flickr():
-    return all([local_settings.FLICKR_API_KEY,
+    return all([flickrapi,
+                local_settings.FLICKR_API_KEY,
                 local_settings.FLICKR_API_SECRET,
                 local_settings.FLICKR_TOKEN])
 
 def _get_flickr():
     global _flickr
-    if not _flickr and _has_flickr():
+    if not _flickr and local_settings.FLICKR_CLIENT:
+        _flickr = get_function(local_settings.FLICKR_CLIENT)()
+    elif not _flickr and _has_flickr():
         _flickr = flickrapi.FlickrAPI(local_settings.FLICKR_API_KEY,
                                       local_settings.FLICKR_API_SECRET,
                                       token=local_settings.FLICKR_TOKEN)
     return _flickr
 
 
-def get_photo_hash(djfile):
-    h = hashlib.sha1()
-    for chunk in djfile.chunks():
-        h.update(chunk)
-    return h.hexdigest()
+def set_flickr(client):
+    """ Swap in a different Flickr client, for example a fake in tests. It
+    needs upload, replace, photos_delete, groups_pools_add and
+    groups_pools_getGroups like flickrapi.FlickrAPI. None goes back to
+    settings.FLICKR_CLIENT or flickrapi. """
+    global _flickr
+    _flickr = client
+
+
+def flickr_available():
+    return bool(_get_flickr())
+
+
+if flickrapi:
+    FlickrError = flickrapi.FlickrError
+else:
+    class FlickrError(Exception):
+        pass
 
 
 def _get_groups():
@@ -45,7 +65,7 @@ def _get_groups():
         if not groups:
             try:
                 groups = flickr.groups_pools_getGroups()._children[0]._children
-            except (URLError, flickrapi.FlickrError) as ex:
+            except (URLError, FlickrError) as ex:
                 logging.exception("Flick error retrieving groups: %s", str(ex))
                 groups = []
             cache.set(key, groups)
@@ -65,11 +85,23 @@ def get_group_id(group_name):
     return ""
 
 
-def sync_to_flickr(answer, group_id):
+def sync_to_flickr(answer, group_id, shared=False, replace=False):
+    """ answer.photo_hash is the hash of answer's photo, or empty if nobody
+    has hashed it since it changed. An answer with both a flickr_id and a
+    photo_hash is already in sync, which costs no file reads at all to find
+    out, unless you pass replace. That means a new upload, hashed as it
+    came in, took the place of the photo on Flickr. shared means other
+    answers use the same Flickr photo, so leave it alone and upload answer's
+    photo separately. This doesn't touch the database, so it's safe to run
+    in a worker thread. """
     flickr = _get_flickr()
 
+    changed = replace or not answer.photo_hash
+    if shared and (changed or not answer.image_answer):
+        answer.flickr_id = ''
     if (not answer.flickr_id) and answer.image_answer:
-        answer.photo_hash = get_photo_hash(answer.image_answer)
+        if not answer.photo_hash:
+            answer.photo_hash = get_photo_hash(answer.image_answer)
 
         filename = answer.image_answer.path.encode('utf-8')
         title = filename.split("/")[-1] # Should we do something fancier here?
@@ -82,24 +114,18 @@ def sync_to_flickr(answer, group_id):
         if photo_id and group_id:
             answer.flickr_id = photo_id
             flickr.groups_pools_add(photo_id=photo_id, group_id=group_id)
-    else:
-        if not answer.image_answer:
-            if answer.flickr_id:
-                res = flickr.photos_delete(photo_id=answer.flickr_id)
-                answer.flickr_id = ''
-            answer.photo_hash = ''
-        else:
-            assert answer.flickr_id
-            new_hash = get_photo_hash(answer.image_answer)
-            if new_hash == answer.photo_hash:
-                # nothing changed
-                return
-            else:
-                answer.photo_hash = new_hash
-
-                res = flickr.replace(filename=answer.image_answer.path,
-                                   photo_id=answer.flickr_id,
-                                   format='etree')
-                photo_id = res.findtext('photoid')
-                answer.flickr_id = photo_id
+    elif not answer.image_answer:
+        if answer.flickr_id:
+            res = flickr.photos_delete(photo_id=answer.flickr_id)
+            answer.flickr_id = ''
+        answer.photo_hash = ''
+    elif changed:
+        # The photo changed since it went to Flickr.
+        if not answer.photo_hash:
+            answer.photo_hash = get_photo_hash(answer.image_answer)
+        res = flickr.replace(filename=answer.image_answer.path,
+                             photo_id=answer.flickr_id,
+                             format='etree')
+        photo_id = res.findtext('photoid')
+        answer.flickr_id = photo_id
     return answer
@@ -25,14 +25,14 @@ from django.forms.formsets import BaseFormSet
 from django.forms.models import ModelForm
 from django.template import Context, loader
 from django.template.defaultfilters import slugify
-from django.utils.html import strip_tags
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext_lazy as _
 
 from .geo import get_latitude_and_longitude
-from .models import OPTION_TYPE_CHOICES, Answer, Survey, Question, Submission
+from .models import (OPTION_TYPE_CHOICES, Answer, Survey, Question,
+                     Submission, option_value)
 from .settings import VIDEO_URL_PATTERNS, IMAGE_UPLOAD_PATTERN
-from .util import get_session, get_user
+from .util import get_photo_hash, get_session, get_user
 
 try:
     from .oembedutils import oembed_expand
@@ -146,15 +146,32 @@ class VideoAnswer(BaseAnswerForm):
 
 class PhotoUpload(BaseAnswerForm):
     answer = ImageField()
+    photo_hash = None
+    dimensions = (None, None)
 
     def clean_answer(self):
         answer = self.cleaned_data['answer']
-        if answer and not get_image_dimensions(answer.file):
+        if answer:
+            self.dimensions = get_image_dimensions(answer.file)
+        if answer and not all(self.dimensions):
             raise ValidationError(_(
                 "We couldn't read your file. Make sure it's a .jpeg, .png, or "
                 ".gif file, not a .psd or other unsupported type."))
+        # Hash it while we have the upload in hand, so that nobody has to
+        # read it back out of storage to find out whether it changed.
+        if answer:
+            self.photo_hash = get_photo_hash(answer)
         return answer
 
+    def save(self, commit=True):
+        ans = super(PhotoUpload, self).save(commit=False)
+        if ans:
+            ans.photo_hash = self.photo_hash
+            ans.image_width, ans.image_height = self.dimensions
+            if commit:
+                ans.save()
+        return ans
+
 
 class LocationAnswer(BaseAnswerForm):
     answer = CharField()
@@ -162,8 +179,11 @@ class LocationAnswer(BaseAnswerForm):
     def save(self, commit=True):
         obj = super(LocationAnswer, self).save(commit=False)
         if obj.value:
-            obj.latitude, obj.longitude = get_latitude_and_longitude(obj.value)
+            # When commit is False the caller geocodes, usually in bulk
+            # through models.process_new_answers.
             if commit:
+                obj.latitude, obj.longitude = get_latitude_and_longitude(
+                    obj.value)
                 obj.save()
             return obj
         return None
@@ -173,13 +193,7 @@ class BaseOptionAnswer(BaseAnswerForm):
     def __init__(self, *args, **kwargs):
         super(BaseOptionAnswer, self).__init__(*args, **kwargs)
         options = self.question.parsed_options
-        # appendChoiceButtons in survey.js duplicates this. jQuery and django
-        # use " for html attributes, so " will mess them up.
-        choices = []
-        for x in options:
-            choices.append(
-                (strip_tags(x).replace('&amp;', '&').replace('"', "'").strip(),
-                 mark_safe(x)))
+        choices = [(option_value(x), mark_safe(x)) for x in options]
         if not self.question.required and not isinstance(self, OptionCheckbox):
             choices = [('', '---------',)] + choices
         self.fields['answer'].choices = choices
@@ -265,7 +279,7 @@ def forms_for_survey(survey, request='testing', submission=None):
     main_form = SubmissionForm(survey, data=post, files=files)
     return [main_form] + [
         _form_for_question(q, session_key, submission, post, files)
-        for q in survey.questions.all().order_by("order")]
+        for q in survey.get_fields()]
 
 
 def _form_for_question(question,
@@ -1,6 +1,7 @@
-import cStringIO
+from collections import OrderedDict
 import logging
-import sys
+from math import asin, cos, degrees, pi, radians, sin
+import threading
 
 try:
     import geopy
@@ -11,23 +12,146 @@ except ImportError:
 from django.conf import settings
 
 from . import settings as local_settings
+from .util import get_function
 
-def get_latitude_and_longitude(location):
+
+def geopy_geocode(location):
+    """ The default geocoder. A geocoder takes a location string and returns
+    a (latitude, longitude) tuple, or (None, None) if it can't find the
+    location. """
     if geopy is None:
         raise ImportError("No module named geopy")
     g = geopy.geocoders.GoogleV3()
-    oldstdout = sys.stdout
+    some = list(g.geocode(location, exactly_one=False))
+    if some:
+        place, (lat, long) = some[0]
+        return lat, long
+    return None, None
+
+
+_geocoder = None
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        if local_settings.GEOCODER:
+            _geocoder = get_function(local_settings.GEOCODER)
+        else:
+            _geocoder = geopy_geocode
+    return _geocoder
+
+
+def set_geocoder(geocoder):
+    """ Swap in a different geocoder, for example a stub in tests. None goes
+    back to settings.GEOCODER. """
+    global _geocoder
+    _geocoder = geocoder
+    clear_geocode_cache()
+
+
+def normalize_location(location):
+    return u" ".join(location.lower().split())
+
+
+class LocationCache(object):
+    """ A small least recently used cache of geocoder results. It sits in
+    front of the GeocodedLocation table so popular locations don't even cost
+    a query. """
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            lat_lng = self._items.pop(key, None)
+            if lat_lng is not None:
+                self._items[key] = lat_lng
+            return lat_lng
+
+    def set(self, key, lat_lng):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = lat_lng
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_location_cache = LocationCache(local_settings.GEOCODE_CACHE_SIZE)
+_stats = dict(memory_hits=0, database_hits=0, misses=0)
+
+
+def clear_geocode_cache():
+    """ Forgets the in memory cache and the hit and miss counts, but not the
+    GeocodedLocation table. """
+    _location_cache.clear()
+    for key in _stats:
+        _stats[key] = 0
+
+
+def geocode_cache_stats():
+    return dict(_stats)
+
+
+def get_latitude_and_longitude(location):
+    # models imports this module.
+    from .models import GeocodedLocation
+    key = normalize_location(location)
+    lat_lng = _location_cache.get(key)
+    if lat_lng is not None:
+        _stats["memory_hits"] += 1
+        return lat_lng
+    found = GeocodedLocation.objects.filter(location=key)
+    found = found.values_list("latitude", "longitude")[:1]
+    if found:
+        _stats["database_hits"] += 1
+        lat_lng = tuple(found[0])
+        _location_cache.set(key, lat_lng)
+        return lat_lng
+    _stats["misses"] += 1
+    geocode = get_geocoder()
     try:
-        sys.stdout = cStringIO.StringIO()
-        try:
-            some = list(g.geocode(location, exactly_one=False))
-            if some:
-                place, (lat, long) = some[0]
-            else:
-                lat = long = None
-        except Exception as ex:
-            logging.exception("error in geocoding: %s" % str(ex))
-            lat = long = None
-    finally:
-        sys.stdout = oldstdout
-    return lat, long
+        lat_lng = tuple(geocode(location))
+    except ImportError:
+        raise
+    except Exception as ex:
+        # Don't remember errors. The geocoder may well be back soon.
+        logging.exception("error in geocoding: %s" % str(ex))
+        return None, None
+    _location_cache.set(key, lat_lng)
+    if None not in lat_lng and len(key) <= GeocodedLocation.MAX_LENGTH:
+        GeocodedLocation.remember(key, lat_lng)
+    return lat_lng
+
+
+EARTH_RADIUS_IN_MILES = 3959.0
+
+
+def bounding_box(lat, lng, miles):
+    """ Returns (min_lat, max_lat, min_lng, max_lng) for the smallest box that
+    holds every point within miles of (lat, lng). min_lng > max_lng means the
+    box wraps around the 180th meridian. min_lng and max_lng are None when
+    the box takes in every longitude, which happens near the poles. See
+    http://janmatuschek.de/LatitudeLongitudeBoundingCoordinates """
+    distance = miles / EARTH_RADIUS_IN_MILES
+    lat_r = radians(lat)
+    min_lat = lat_r - distance
+    max_lat = lat_r + distance
+    if min_lat <= -pi / 2 or max_lat >= pi / 2:
+        return (max(-90.0, degrees(min_lat)),
+                min(90.0, degrees(max_lat)),
+                None,
+                None)
+    delta_lng = degrees(asin(sin(distance) / cos(lat_r)))
+    min_lng = lng - delta_lng
+    if min_lng < -180.0:
+        min_lng += 360.0
+    max_lng = lng + delta_lng
+    if max_lng > 180.0:
+        max_lng -= 360.0
+    return degrees(min_lat), degrees(max_lat), min_lng, max_lng
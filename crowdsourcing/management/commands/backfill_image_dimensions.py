@@ -0,0 +1,34 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing.models import Answer
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ("Fill in image_width and image_height for photo answers saved "
+            "before crowdsourcing kept them, so that report pages don't "
+            "have to open the photos. Covers every survey unless you pass "
+            "survey slugs.")
+
+    def handle(self, *args, **options):
+        answers = Answer.objects.filter(image_width__isnull=True)
+        answers = answers.exclude(image_answer='')
+        if args:
+            answers = answers.filter(question__survey__slug__in=args)
+        filled = unreadable = 0
+        for answer in answers.only("id", "image_answer").iterator():
+            try:
+                answer.set_image_dimensions(answer.image_answer)
+            finally:
+                answer.image_answer.close()
+            if answer.image_width:
+                Answer.objects.filter(pk=answer.pk).update(
+                    image_width=answer.image_width,
+                    image_height=answer.image_height)
+                filled += 1
+            else:
+                unreadable += 1
+        self.stdout.write("Filled in %d photos. Couldn't read %d.\n" % (
+            filled, unreadable))
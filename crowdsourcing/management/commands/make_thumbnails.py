@@ -0,0 +1,28 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing.models import Answer, OPTION_TYPE_CHOICES
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ("Make and record every size of thumbnail for photo answers that "
+            "don't have them yet, such as those from before crowdsourcing "
+            "made thumbnails up front. Covers every survey unless you pass "
+            "survey slugs.")
+
+    def handle(self, *args, **options):
+        answers = Answer.objects.filter(
+            question__option_type=OPTION_TYPE_CHOICES.PHOTO,
+            thumbnails='').exclude(image_answer='')
+        if args:
+            answers = answers.filter(question__survey__slug__in=args)
+        answers.update(thumbnails_pending=True)
+        tried = 0
+        while True:
+            batch = Answer.make_pending_thumbnails()
+            if not batch:
+                break
+            tried += batch
+        self.stdout.write("Made thumbnails for %d photos\n" % tried)
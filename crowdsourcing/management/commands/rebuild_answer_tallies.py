@@ -0,0 +1,21 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing.models import AnswerTally, Question
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ("Recount the AnswerTally rows that unfiltered pie charts use when "
+            "CROWDSOURCING_USE_ANSWER_TALLIES is on. Recounts every survey "
+            "unless you pass survey slugs.")
+
+    def handle(self, *args, **options):
+        questions = Question.objects.select_related("survey")
+        if args:
+            questions = questions.filter(survey__slug__in=args)
+        for question in questions:
+            AnswerTally.rebuild([question])
+            self.stdout.write("Recounted %s: %s\n" % (question.survey.slug,
+                                                      question.fieldname))
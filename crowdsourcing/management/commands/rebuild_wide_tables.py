@@ -0,0 +1,30 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing import wide
+from crowdsourcing.models import Survey
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ("Rebuild the wide table, one row per submission and one column "
+            "per question, of every survey with use_wide_table checked, or "
+            "of the surveys you pass. Drops the wide tables of surveys you "
+            "pass that don't use one.")
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.all()
+        if args:
+            surveys = surveys.filter(slug__in=args)
+        else:
+            surveys = surveys.filter(use_wide_table=True)
+        for survey in surveys:
+            if survey.use_wide_table:
+                wide.rebuild(survey.id, force=True)
+                self.stdout.write("Rebuilt %s: %d submissions\n" % (
+                    survey.slug,
+                    survey.submission_count))
+            else:
+                wide.drop(survey.id)
+                self.stdout.write("Dropped %s\n" % survey.slug)
@@ -0,0 +1,23 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+
+from crowdsourcing.models import Survey
+
+
+class Command(BaseCommand):
+    args = '[survey_slug survey_slug ...]'
+    help = ("Recount each survey's submission_count, public_submission_count "
+            "and last_submitted_at. Recounts every survey unless you pass "
+            "survey slugs.")
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.all()
+        if args:
+            surveys = surveys.filter(slug__in=args)
+        for survey in surveys:
+            survey.recount()
+            self.stdout.write("Recounted %s: %d submissions, %d public\n" % (
+                survey.slug,
+                survey.submission_count,
+                survey.public_submission_count))
@@ -0,0 +1,110 @@
+from __future__ import absolute_import
+
+import os
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from crowdsourcing.models import (Answer, OPTION_TYPE_CHOICES, Question,
+                                  Survey)
+
+
+SQL_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "sql")
+
+
+def index_statements():
+    """ The CREATE INDEX statements in crowdsourcing/sql for this database,
+    the same ones syncdb runs for new tables. """
+    backend = connection.settings_dict['ENGINE'].split('.')[-1]
+    statements = []
+    for model in ("answer", "submission"):
+        for name in ("%s.%s.sql" % (model, backend), "%s.sql" % model):
+            path = os.path.join(SQL_DIR, name)
+            if not os.path.exists(path):
+                continue
+            sql = re.sub(r"--.*", "", open(path).read())
+            statements.extend(s.strip() for s in sql.split(";") if s.strip())
+    return statements
+
+
+def drop_statement(create):
+    name, table = re.match(r"CREATE INDEX (\w+) ON (\w+)", create).groups()
+    if connection.vendor == "mysql":
+        return "DROP INDEX %s ON %s" % (name, table)
+    return "DROP INDEX %s" % name
+
+
+def sample_queries(survey):
+    """ The queries that reports and filters run the most, as
+    (description, queryset) pairs. """
+    OTC = OPTION_TYPE_CHOICES
+    submissions = survey.submission_set.filter(is_public=True)
+    page = submissions.order_by("-submitted_at", "-id")[:20]
+    queries = [("report page", page),
+               ("answers for a page", Answer.objects.filter(
+                   submission__in=list(page.values_list("id", flat=True))))]
+    questions = Question.objects.filter(survey=survey)
+    choices = questions.filter(option_type__in=(OTC.CHOICE, OTC.SELECT))
+    for question in choices[:1]:
+        answers = question.answer_set.filter(submission__is_public=True)
+        queries.append(("pie chart counts", answers.values(
+            "text_answer").annotate(count=Count("id"))))
+        options = question.parsed_options
+        if options:
+            queries.append(("choice filter", question.answer_set.filter(
+                text_answer=options[0]).values("submission_id")))
+    numbers = questions.filter(option_type__in=(OTC.INTEGER,
+                                                OTC.NUMERIC_SELECT,
+                                                OTC.NUMERIC_CHOICE))
+    for question in numbers[:1]:
+        queries.append(("range filter", question.answer_set.filter(
+            integer_answer__gte=0).values("submission_id")))
+    return queries
+
+
+class Command(BaseCommand):
+    args = 'create|drop|explain [survey_slug] [runs]'
+    help = ("Create or drop the composite indexes in crowdsourcing/sql on "
+            "existing tables, or explain and time the queries that survey "
+            "reports run most for a survey, by default the one with the "
+            "most submissions. Explain before and after create to see the "
+            "difference.")
+
+    def handle(self, *args, **options):
+        if not args or args[0] not in ("create", "drop", "explain"):
+            raise CommandError("Usage: report_indexes %s" % self.args)
+        if "explain" == args[0]:
+            return self.explain(*args[1:])
+        cursor = connection.cursor()
+        for create in index_statements():
+            sql = create if "create" == args[0] else drop_statement(create)
+            self.stdout.write(sql + "\n")
+            cursor.execute(sql)
+        transaction.commit_unless_managed()
+
+    def explain(self, slug=None, runs=10):
+        surveys = Survey.objects.all()
+        if slug:
+            surveys = surveys.filter(slug=slug)
+        surveys = surveys.order_by("-submission_count")[:1]
+        if not surveys:
+            raise CommandError("No such survey.")
+        explain = "EXPLAIN "
+        if connection.vendor == "sqlite":
+            explain = "EXPLAIN QUERY PLAN "
+        cursor = connection.cursor()
+        for description, queryset in sample_queries(surveys[0]):
+            sql, params = queryset.query.sql_with_params()
+            self.stdout.write("%s\n%s\n" % (description, sql % params))
+            cursor.execute(explain + sql, params)
+            for row in cursor.fetchall():
+                self.stdout.write("    %s\n" % " | ".join(map(str, row)))
+            start = time.time()
+            for i in range(int(runs)):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            elapsed = (time.time() - start) * 1000 / int(runs)
+            self.stdout.write("    %.2f ms on average\n\n" % elapsed)
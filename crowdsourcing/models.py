@@ -1,12 +1,16 @@
 from __future__ import absolute_import
 
 
+from copy import copy
 import datetime
+from itertools import islice
 import logging
 from math import sin, cos
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
-import re
 from textwrap import fill
+import threading
+import traceback
 
 try:
     import simplejson as json
@@ -16,18 +20,25 @@ except ImportError:
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files.images import get_image_dimensions
 from django.core.urlresolvers import reverse
-from django.db import models, connection
-from django.db.models import Count
+from django.db import models, connection, IntegrityError
+from django.db.models import Count, F, Max, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.db.models.fields.files import ImageFieldFile
 from django.db.models.query import EmptyQuerySet
 from decimal import Decimal
+from django.utils.html import strip_tags
 from django.utils.translation import ugettext_lazy as _
 from django.utils.safestring import mark_safe
 
 
+from .caching import (SITES_VERSION_KEY, bump_survey_version, bump_version,
+                      get_survey_version, make_key)
 from .fields import ImageWithThumbnailsField
-from .geo import get_latitude_and_longitude
+from .geo import bounding_box, get_latitude_and_longitude
+from . import wide
 from .util import ChoiceEnum
 from . import settings as local_settings
 
@@ -41,10 +52,10 @@ except ImportError:
 
 
 try:
-    from .flickrsupport import sync_to_flickr, get_group_id
+    from .flickrsupport import flickr_available, get_group_id, sync_to_flickr
 except ImportError:
     logging.warn('no flickr support available')
-    sync_to_flickr = None
+    flickr_available = lambda: False
 
 
 ARCHIVE_POLICY_CHOICES = ChoiceEnum(('immediate',
@@ -142,12 +153,30 @@ class Survey(models.Model):
         help_text=("Whenever we automatically generate a link to the results "
                    "of this survey we'll use this report. If it's left blank, "
                    "we'll use the default report behavior."))
+    # Kept up to date as people submit and staff moderate, so that we don't
+    # have to count. Fix them with ./manage.py recount_submissions
+    submission_count = models.IntegerField(default=0, editable=False)
+    public_submission_count = models.IntegerField(default=0, editable=False)
+    last_submitted_at = models.DateTimeField(null=True,
+                                             blank=True,
+                                             editable=False)
+    use_wide_table = models.BooleanField(
+        default=False,
+        help_text=_("Keep a table with one row per submission and one column "
+                    "per question, which makes exports, filters and charts "
+                    "faster for surveys with many submissions or questions. "
+                    "./manage.py rebuild_wide_tables, or the BuildWideTables "
+                    "task, builds it."))
+    wide_table_state = models.PositiveIntegerField(
+        choices=wide.STATES._choices,
+        default=wide.STATES.MISSING,
+        editable=False)
 
     def to_jsondata(self):
         kwargs = {'slug': self.slug}
         submit_url = reverse('embeded_survey_questions', kwargs=kwargs)
         report_url = reverse('survey_default_report_page_1', kwargs=kwargs)
-        questions = self.questions.order_by("order")
+        questions = self.get_fields()
         return dict(title=self.title,
                     id=self.id,
                     slug=self.slug,
@@ -161,9 +190,36 @@ class Survey(models.Model):
     def save(self, **kwargs):
         self.survey_date = self.starts_at.date()
         self.flickr_group_id = ""
-        if self.flickr_group_name and sync_to_flickr:
+        if self.flickr_group_name and flickr_available():
             self.flickr_group_id = get_group_id(self.flickr_group_name)
+        was_wide = False
+        if self.pk:
+            # Don't overwrite submissions counted, or wide table progress,
+            # since we loaded the survey.
+            counts = Survey.objects.filter(pk=self.pk)
+            fields = SURVEY_COUNT_FIELDS + ("wide_table_state",)
+            for current in counts.values("use_wide_table", *fields):
+                was_wide = current.pop("use_wide_table")
+                self.__dict__.update(current)
+        drop_wide_table = was_wide and not self.use_wide_table
+        if drop_wide_table:
+            self.wide_table_state = wide.STATES.MISSING
         super(Survey, self).save(**kwargs)
+        if was_wide != self.use_wide_table:
+            wide.changed_wide_surveys()
+        if drop_wide_table:
+            wide.drop(self.pk)
+
+    def recount(self):
+        """ Count the submissions from scratch. """
+        submissions = self.submission_set.all()
+        counts = dict(
+            submission_count=submissions.count(),
+            public_submission_count=submissions.filter(is_public=True).count(),
+            last_submitted_at=submissions.aggregate(
+                last=Max("submitted_at"))["last"])
+        Survey.objects.filter(pk=self.pk).update(**counts)
+        self.__dict__.update(counts)
 
     class Meta:
         ordering = ('-starts_at',)
@@ -190,11 +246,14 @@ class Survey(models.Model):
             return self.get_fields(fieldnames)
         return [f for f in self.get_fields() if f.answer_is_public]
 
+    def get_schema(self):
+        if not self.pk:
+            return SurveySchema(None, ())
+        return SurveySchema.for_survey(self.pk)
+
     def get_fields(self, fieldnames=None):
         if not "_fields" in self.__dict__:
-            questions = self.questions.all()
-            questions = questions.select_related("survey")
-            self.__dict__["_fields"] = list(questions.order_by("order"))
+            self.__dict__["_fields"] = self.get_schema().bind(self)
         fields = self.__dict__["_fields"]
         if fieldnames:
             return [f for f in fields if f.fieldname in fieldnames]
@@ -212,18 +271,13 @@ class Survey(models.Model):
         return [f for f in self.get_fields() if f.option_type in types]
 
     def icon_questions(self):
-        OTC = OPTION_TYPE_CHOICES
-        return self.questions.filter(
-            ~models.Q(map_icons=""),
-            option_type__in=[OTC.SELECT,
-                             OTC.CHOICE,
-                             OTC.NUMERIC_SELECT,
-                             OTC.NUMERIC_CHOICE])
+        icon_ids = self.get_schema().icon_question_ids
+        return [f for f in self.get_fields() if f.id in icon_ids]
 
     def parsed_option_icon_pairs(self):
-        icon_questions = self.icon_questions()
-        if icon_questions:
-            return icon_questions[0].parsed_option_icon_pairs()
+        schema = self.get_schema()
+        if schema.icon_question_ids:
+            return schema.option_icon_pairs[schema.icon_question_ids[0]]
         return ()
 
     def submissions_for(self, user, session_key):
@@ -251,9 +305,7 @@ class Survey(models.Model):
         return self.public_submissions().filter(featured=True)
 
     def get_filters(self):
-        return self.questions.filter(use_as_filter=True,
-                                     answer_is_public=True,
-                                     option_type__in=FILTERABLE_OPTION_TYPES)
+        return [f for f in self.get_public_fields() if f.is_filterable]
 
     def __unicode__(self):
         return self.title
@@ -280,6 +332,27 @@ class Survey(models.Model):
     live = LiveSurveyManager()
 
 
+SURVEY_COUNT_FIELDS = ("submission_count",
+                       "public_submission_count",
+                       "last_submitted_at")
+
+
+def _adjust_survey_counts(survey_id, total, public, submitted_at=None):
+    updates = {}
+    if total:
+        updates["submission_count"] = F("submission_count") + total
+    if public:
+        updates["public_submission_count"] = (
+            F("public_submission_count") + public)
+    if updates:
+        Survey.objects.filter(pk=survey_id).update(**updates)
+    if submitted_at:
+        later = (models.Q(last_submitted_at=None) |
+                 models.Q(last_submitted_at__lt=submitted_at))
+        surveys = Survey.objects.filter(later, pk=survey_id)
+        surveys.update(last_submitted_at=submitted_at)
+
+
 FILTERABLE_OPTION_TYPES = (OPTION_TYPE_CHOICES.LOCATION,
                            OPTION_TYPE_CHOICES.INTEGER,
                            OPTION_TYPE_CHOICES.FLOAT,
@@ -294,6 +367,13 @@ POSITION_HELP = ("What order does this question appear in the survey form and "
                  "in permalinks?")
 
 
+def option_value(option):
+    """ The text an answer stores for an option. appendChoiceButtons in
+    survey.js duplicates this. jQuery and django use " for html attributes,
+    so " will mess them up. """
+    return strip_tags(option).replace('&amp;', '&').replace('"', "'").strip()
+
+
 class Question(models.Model):
     survey = models.ForeignKey(Survey, related_name="questions")
     fieldname = models.CharField(
@@ -386,13 +466,36 @@ class Question(models.Model):
                     self.numeric_is_int = False
         elif self.option_type == OTC.FLOAT:
             self.numeric_is_int = False
+        retally = False
+        if self.pk and local_settings.USE_ANSWER_TALLIES:
+            # Tallies hold the text of the value column, so switching between
+            # integer and float columns means counting again.
+            try:
+                old = Question.objects.get(pk=self.pk)
+                retally = old.value_column != self.value_column
+            except Question.DoesNotExist:
+                pass
         super(Question, self).save(*args, **kwargs)
+        if retally:
+            AnswerTally.rebuild([self])
 
     @property
     def parsed_options(self):
         if OPTION_TYPE_CHOICES.BOOL == self.option_type:
             return [True, False]
-        return filter(None, (s.strip() for s in self.options.splitlines()))
+        # Remember the parsed options for as long as the text doesn't change.
+        options, parsed = self.__dict__.get("_parsed_options", (None, ()))
+        if options != self.options:
+            parsed = tuple(s.strip() for s in self.options.splitlines())
+            parsed = tuple(filter(None, parsed))
+            self.__dict__["_parsed_options"] = (self.options, parsed)
+        return list(parsed)
+
+    @property
+    def option_values(self):
+        """ What answers store for each of parsed_options, which can hold
+        markup. """
+        return [option_value(option) for option in self.parsed_options]
 
     @property
     def parsed_map_icons(self):
@@ -441,6 +544,85 @@ class Question(models.Model):
         return self.is_numeric and self.numeric_is_int
 
 
+_question_survey_cache = Question._meta.get_field("survey").get_cache_name()
+
+
+class SurveySchema(object):
+    """ Everything about a survey's questions that reports, forms, and the
+    API look up over and over again, worked out once. Schemas are cached in
+    this process and in the shared cache under the survey's "schema" version,
+    which changes whenever the survey or one of its questions is saved or
+    deleted. Don't modify a schema or its questions. Survey.get_fields hands
+    out copies. """
+    _local = {}
+    _lock = threading.Lock()
+
+    def __init__(self, survey_id, questions, wide_table_state=None):
+        self.survey_id = survey_id
+        self.wide_table_state = wide_table_state or wide.STATES.MISSING
+        self.questions = tuple(questions)
+        self.fieldnames = tuple(q.fieldname for q in self.questions)
+        self.options = {}
+        self.option_icon_pairs = {}
+        self.value_columns = {}
+        for q in self.questions:
+            self.options[q.id] = tuple(q.parsed_options)
+            self.option_icon_pairs[q.id] = tuple(q.parsed_option_icon_pairs())
+            self.value_columns[q.id] = q.value_column
+        self.filterable_ids = tuple(
+            q.id for q in self.questions
+            if q.answer_is_public and q.is_filterable)
+        OTC = OPTION_TYPE_CHOICES
+        icon_types = (OTC.SELECT,
+                      OTC.CHOICE,
+                      OTC.NUMERIC_SELECT,
+                      OTC.NUMERIC_CHOICE)
+        self.icon_question_ids = tuple(
+            q.id for q in self.questions
+            if q.map_icons and q.option_type in icon_types)
+
+    def bind(self, survey):
+        """ Fresh copies of the questions for survey to use, so that nobody
+        changes the cached ones. """
+        bound = []
+        for question in self.questions:
+            question = copy(question)
+            # Saving a question updates its _state.
+            question._state = copy(question._state)
+            setattr(question, _question_survey_cache, survey)
+            bound.append(question)
+        return bound
+
+    @classmethod
+    def build(cls, survey_id):
+        questions = Question.objects.filter(survey__id=survey_id)
+        states = []
+        if survey_id in wide.wide_survey_ids():
+            surveys = Survey.objects.filter(pk=survey_id, use_wide_table=True)
+            states = list(surveys.values_list("wide_table_state", flat=True))
+        return cls(survey_id,
+                   questions.order_by("order"),
+                   states[0] if states else None)
+
+    @classmethod
+    def for_survey(cls, survey_id):
+        if not local_settings.CACHE_SURVEY_SCHEMA:
+            return cls.build(survey_id)
+        version = get_survey_version(survey_id, "schema")
+        with cls._lock:
+            found = cls._local.get(survey_id)
+        if found and found[0] == version:
+            return found[1]
+        key = make_key("schema", survey_id, version)
+        schema = cache.get(key, None)
+        if schema is None:
+            schema = cls.build(survey_id)
+            cache.set(key, schema, local_settings.SURVEY_SCHEMA_TIMEOUT)
+        with cls._lock:
+            cls._local[survey_id] = (version, schema)
+        return schema
+
+
 FILTER_TYPE = ChoiceEnum("choice range distance")
 
 
@@ -472,82 +654,314 @@ class Filter:
             self.location_value = get_val("_location")
 
 
+class ReportContext(object):
+    """ Everything a request's filters mean for a survey, worked out once per
+    request no matter how many displays, template tags and views ask. Use
+    ReportContext.get rather than building these yourself. """
+    def __init__(self, survey, request_data):
+        self.survey = survey
+        self.request_data = request_data
+        self.filters = [Filter(f, request_data) for f in survey.get_filters()]
+        self._compiled = None
+        signature = []
+        for f in self.filters:
+            values = (f.value,
+                      f.from_value,
+                      f.to_value,
+                      f.within_value,
+                      f.location_value.strip().lower())
+            if any(values):
+                signature.append((f.key,) + values)
+        self.signature = tuple(signature)
+
+    @property
+    def compiled(self):
+        """ The filters as CompiledFilters. Distance filters geocode here, so
+        only once. """
+        if self._compiled is None:
+            conditions = _filter_conditions(self.filters)
+            questions = [f.field for f in self.filters]
+            wide_survey_id = None
+            if wide.covers(self.survey.id, questions):
+                wide_survey_id = self.survey.id
+            self._compiled = CompiledFilters(conditions, wide_survey_id)
+        return self._compiled
+
+    def plan(self, report):
+        """ Look over the report's displays for every count, sum and average
+        their charts will need. The first chart to ask then computes all the
+        counts in one pass over crowdsourcing_answer, and all the bar and line
+        chart series that share an x axis in one more pass per x axis. """
+        SRDC = SURVEY_DISPLAY_TYPE_CHOICES
+        SATC = SURVEY_AGGREGATE_TYPE_CHOICES
+        functions = {SATC.DEFAULT: "SUM",
+                     SATC.SUM: "SUM",
+                     SATC.AVERAGE: "AVG",
+                     SATC.COUNT: "COUNT"}
+        self._featured = bool(report.featured)
+        self._count_questions = {}
+        self._counts = {}
+        self._two_axis_columns = {}
+        self._two_axis_rows = {}
+        for display in report.get_survey_report_displays() or []:
+            if SRDC.PIE == display.display_type:
+                for question in display.questions():
+                    self._count_questions[question.id] = question
+            elif display.display_type in (SRDC.BAR, SRDC.LINE):
+                x_axis = display.x_axis_question()
+                y_axes = display.questions()
+                if not x_axis:
+                    continue
+                if SATC.COUNT == display.aggregate_type and not y_axes:
+                    self._count_questions[x_axis.id] = x_axis
+                    continue
+                x_axis, columns = self._two_axis_columns.setdefault(
+                    x_axis.id, (x_axis, []))
+                function = functions[display.aggregate_type]
+                for y_axis in y_axes:
+                    if not (function, y_axis) in columns:
+                        columns.append((function, y_axis))
+
+    def planned_counts(self, field, is_staff, featured):
+        """ Rows like those from AggregateResultCount's own query, or None if
+        the plan doesn't cover this count. """
+        if field.id not in getattr(self, "_count_questions", {}):
+            return None
+        key = (bool(is_staff), bool(featured))
+        if key not in self._counts:
+            self._counts[key] = self._count_all(*key)
+        return self._counts[key].get(field.id, [])
+
+    def _count_all(self, is_staff, featured):
+        questions = [q for q in self._count_questions.values()
+                     if is_staff or q.answer_is_public]
+        if not questions:
+            return {}
+        answers = Answer.objects.filter(question__in=questions)
+        if not is_staff:
+            answers = answers.filter(submission__is_public=True)
+        if featured:
+            answers = answers.filter(submission__featured=True)
+        answers = self.compiled.apply(answers, "submission_id")
+        columns = sorted(set(q.value_column for q in questions))
+        answers = answers.values("question", *columns)
+        by_id = dict((q.id, q) for q in questions)
+        counts = {}
+        for row in answers.annotate(count=Count("id")).order_by():
+            question = by_id[row["question"]]
+            key = (question.id, row[question.value_column])
+            counts[key] = counts.get(key, 0) + row["count"]
+        rows = {}
+        for (question_id, value), count in counts.items():
+            column = by_id[question_id].value_column
+            rows.setdefault(question_id, []).append({column: value,
+                                                     "count": count})
+        return rows
+
+    def planned_two_axis(self, x_axis, y_axes, aggregate_function, featured):
+        """ Rows of (x value, y value, y value...) for y_axes, or None if the
+        plan doesn't cover this chart. """
+        columns_by_x = getattr(self, "_two_axis_columns", {})
+        if x_axis.id not in columns_by_x or featured != self._featured:
+            return None
+        planned_x_axis, columns = columns_by_x[x_axis.id]
+        # The plan runs a single pass query, which the wide table always
+        # can, and crowdsourcing_answer only if the setting allows it.
+        questions = [planned_x_axis] + [y_axis for f, y_axis in columns]
+        if not (local_settings.SINGLE_PASS_AGGREGATES or
+                wide.covers(x_axis.survey_id, questions)):
+            return None
+        keys = [(aggregate_function, y_axis.id) for y_axis in y_axes]
+        planned_keys = [(f, y_axis.id) for f, y_axis in columns]
+        if not all(key in planned_keys for key in keys):
+            return None
+        if x_axis.id not in self._two_axis_rows:
+            query, params = AggregateResult2Axis._columns_query(
+                columns,
+                planned_x_axis,
+                self.request_data,
+                featured)
+            cursor = connection.cursor()
+            cursor.execute(query, params)
+            self._two_axis_rows[x_axis.id] = cursor.fetchall()
+        indexes = [planned_keys.index(key) + 1 for key in keys]
+        return [(row[0],) + tuple(row[i] for i in indexes)
+                for row in self._two_axis_rows[x_axis.id]]
+
+    @classmethod
+    def get(cls, survey, request_data):
+        """ Remembered on request_data, i.e. request.GET, which everything
+        rendering the request shares. """
+        contexts = getattr(request_data, "_crowdsourcing_reports", None)
+        if contexts is None:
+            contexts = {}
+            try:
+                request_data._crowdsourcing_reports = contexts
+            except AttributeError:
+                # A plain dict. Just don't remember.
+                pass
+        if survey.id not in contexts:
+            contexts[survey.id] = cls(survey, request_data)
+        return contexts[survey.id]
+
+
 def get_filters(survey, request_data):
-    fields = list(survey.get_public_fields())
-    return [Filter(f, request_data) for f in fields if f.is_filterable]
+    return list(ReportContext.get(survey, request_data).filters)
+
+
+def filter_signature(survey, request_data):
+    """ The filter values that actually narrow down the results, in a
+    stable order. Use this rather than the raw query string to build cache
+    keys. """
+    return ReportContext.get(survey, request_data).signature
+
+
+def _aggregate_cache_key(survey, request_data, *parts):
+    if not local_settings.REPORT_CACHE_TIMEOUT:
+        return None
+    return make_key("aggregate",
+                    survey.id,
+                    get_survey_version(survey.id),
+                    filter_signature(survey, request_data),
+                    *parts)
 
 
 def extra_from_filters(set, submission_id_column, survey, request_data):
-    sid = submission_id_column
-    for where, params in extra_clauses_from_filters(sid, survey, request_data):
-        set = set.extra(where=[where], params=params)
-    return set
+    return compile_filters(survey, request_data).apply(set,
+                                                       submission_id_column)
 
 
 def extra_clauses_from_filters(submission_id_column, survey, request_data):
-    return_value = []
-    for filter in get_filters(survey, request_data):
+    """ A list with at most one (where, params) clause, which covers all the
+    filters. """
+    compiled = compile_filters(survey, request_data)
+    if compiled:
+        return [compiled.where(submission_id_column)]
+    return []
+
+
+class CompiledFilters(object):
+    """ Every active filter in a request compiled into a single subquery that
+    finds the matching submission ids. Each filter after the first joins
+    crowdsourcing_answer once more on submission_id, so the database plans
+    one query no matter how many filters there are, and the question and
+    value indexes serve every join. Build these with compile_filters. """
+    def __init__(self, conditions, wide_survey_id=None):
+        """ conditions holds a (where, params) pair for each filter, with
+        "{a}." in front of each crowdsourcing_answer column. Pass
+        wide_survey_id to query that survey's wide table instead. """
+        if conditions and wide_survey_id:
+            self.sql, self.params = wide.filter_subquery(wide_survey_id,
+                                                         conditions)
+            return
+        self.params = []
+        tables = []
+        wheres = []
+        for i, (where, params) in enumerate(conditions):
+            alias = "f%d" % i
+            if i:
+                tables.append("".join((" INNER JOIN crowdsourcing_answer ",
+                                       alias,
+                                       " ON ",
+                                       alias,
+                                       ".submission_id = f0.submission_id")))
+            else:
+                tables.append("crowdsourcing_answer f0")
+            wheres.append(alias + ".question_id = %s AND " +
+                          where.replace("{a}.", alias + "."))
+            self.params.extend(params)
+        self.sql = ""
+        if conditions:
+            self.sql = "".join(["SELECT f0.submission_id FROM "] + tables +
+                               [" WHERE "] + [" AND ".join(wheres)])
+
+    def __nonzero__(self):
+        return bool(self.sql)
+
+    def where(self, submission_id_column):
+        return (submission_id_column + " IN (" + self.sql + ")",
+                list(self.params))
+
+    def apply(self, queryset, submission_id_column):
+        if not self:
+            return queryset
+        where, params = self.where(submission_id_column)
+        return queryset.extra(where=[where], params=params)
+
+
+def compile_filters(survey, request_data):
+    """ The submission list, every chart, and the map share the result. """
+    return ReportContext.get(survey, request_data).compiled
+
+
+def _filter_conditions(filters):
+    conditions = []
+    OTC = OPTION_TYPE_CHOICES
+    for filter in filters:
         loc = filter.location_value and filter.within_value
-        if filter.value or filter.from_value or filter.to_value or loc:
-            try:
-                OTC = OPTION_TYPE_CHOICES
-                where = "".join((
-                    submission_id_column,
-                    " IN (SELECT submission_id FROM ",
-                    "crowdsourcing_answer WHERE question_id = %d ",
-                    "AND ")) % filter.field.id
-                if OTC.BOOL == filter.field.option_type:
-                    f = ("0", "f",)
-                    length = len(filter.value)
-                    params = [length and not filter.value[0].lower() in f]
-                    where += "boolean_answer = %s"
-                elif filter.field.is_numeric:
-                    column = filter.field.value_column
-                    convert = float if filter.field.is_float else int
-                    params = []
-                    wheres = []
-                    if filter.from_value:
-                        params.append(convert(filter.from_value))
-                        wheres.append("%s <= " + column)
-                    if filter.to_value:
-                        params.append(convert(filter.to_value))
-                        wheres.append(column + " <= %s")
-                    if filter.value:
-                        params.append(convert(filter.value))
-                        wheres.append(column + " = %s")
-                    where += " AND ".join(wheres)
-                elif OTC.LOCATION == filter.field.option_type:
-                    e = _extra_from_distance(filter, submission_id_column)
-                    if e:
-                        d_where, params = e
-                        where += d_where
-                    else:
-                        break
-                else:
-                    params = [filter.value]
-                    where += "text_answer = %s"
-                where += ")"
-                return_value.append((where, params,))
-            except ValueError:
-                pass
-    return return_value
+        if not (filter.value or filter.from_value or filter.to_value or loc):
+            continue
+        try:
+            if OTC.BOOL == filter.field.option_type:
+                f = ("0", "f",)
+                length = len(filter.value)
+                params = [length and not filter.value[0].lower() in f]
+                where = "{a}.boolean_answer = %s"
+            elif filter.field.is_numeric:
+                column = "{a}." + filter.field.value_column
+                convert = float if filter.field.is_float else int
+                params = []
+                wheres = []
+                if filter.from_value:
+                    params.append(convert(filter.from_value))
+                    wheres.append("%s <= " + column)
+                if filter.to_value:
+                    params.append(convert(filter.to_value))
+                    wheres.append(column + " <= %s")
+                if filter.value:
+                    params.append(convert(filter.value))
+                    wheres.append(column + " = %s")
+                where = " AND ".join(wheres)
+            elif OTC.LOCATION == filter.field.option_type:
+                e = _extra_from_distance(filter)
+                if not e:
+                    # We couldn't find the location, so ignore this filter.
+                    continue
+                where, params = e
+            else:
+                params = [filter.value]
+                where = "{a}.text_answer = %s"
+        except ValueError:
+            continue
+        conditions.append((where, [filter.field.id] + params))
+    return conditions
 
 
-def _extra_from_distance(filter, submission_id_column):
+def _extra_from_distance(filter):
     """ This uses the Spherical Law of Cosines for a close enough approximation
     of distances. distance = acos(sin(lat1) * sin(lat2) +
                                   cos(lat1) * cos(lat2) *
                                   cos(lng2 - lng1)) * 3959
-    The "radius" of the earth varies between 3,950 and 3,963 miles. """
-    spaces = re.compile(r'\s')
-    key = spaces.sub("+", "lat_lng_of_" + str(filter.location_value.lower()))
-    lat_lng = cache.get(key, None)
-    if lat_lng is None:
-        lat_lng = get_latitude_and_longitude(filter.location_value)
-        cache.set(key, lat_lng)
-    (lat, lng) = lat_lng
+    The "radius" of the earth varies between 3,950 and 3,963 miles.
+    Evaluating that for every location in the survey is slow, so first we
+    narrow down to a latitude and longitude bounding box the indexes on
+    those columns can find, and only check the exact distance inside it. """
+    (lat, lng) = get_latitude_and_longitude(filter.location_value)
     if lat is None or lng is None:
         return
+    miles = float(filter.within_value)
+    min_lat, max_lat, min_lng, max_lng = bounding_box(lat, lng, miles)
+    wheres = ["{a}.latitude BETWEEN %s AND %s"]
+    params = [min_lat, max_lat]
+    if min_lng is None:
+        pass
+    elif min_lng <= max_lng:
+        wheres.append("{a}.longitude BETWEEN %s AND %s")
+        params.extend([min_lng, max_lng])
+    else:
+        # The box wraps around the 180th meridian.
+        wheres.append("({a}.longitude >= %s OR {a}.longitude <= %s)")
+        params.extend([min_lng, max_lng])
     acos_of_args = (
         sin(_radians(lat)),
         _D_TO_R,
@@ -556,28 +970,21 @@ def _extra_from_distance(filter, submission_id_column):
         lng,
         _D_TO_R)
     acos_of = (
-        "%f * sin(latitude / %f) + "
-        "%f * cos(latitude / %f) * "
-        "cos((longitude - %f) / %f)") % acos_of_args
+        "%f * sin({a}.latitude / %f) + "
+        "%f * cos({a}.latitude / %f) * "
+        "cos(({a}.longitude - %f) / %f)") % acos_of_args
     # if acos_of >= 1 then the address in the database is practically the
     # same address we're searching for and acos(acos_of) is mathematically 
     # impossible so just always include it. If acos_of < 1 then we need to
-    # check the distance.
-    where = "".join((
-        submission_id_column,
-        " IN (SELECT ca.submission_id FROM ",
-        "crowdsourcing_answer AS ca JOIN crowdsourcing_submission AS cs ",
-        "ON ca.submission_id = cs.id ",
-        "WHERE cs.survey_id = %s AND latitude IS NOT NULL ",
-        "AND longitude IS NOT NULL AND ",
-        acos_of,
-        " >= 1 OR (",
+    # check the distance. CASE makes sure we never take acos of it anyway.
+    wheres.append("".join((
+        "CASE WHEN ",
         acos_of,
-        " < 1 AND 3959.0 * acos(",
+        " >= 1 THEN 0 ELSE 3959.0 * acos(",
         acos_of,
-        ") <= %s))"))
-    params = [int(filter.field.survey_id), int(filter.within_value)]
-    return where, params
+        ") END <= %s")))
+    params.append(miles)
+    return " AND ".join(wheres), params
 
 
 _D_TO_R = 57.295779
@@ -598,21 +1005,54 @@ class AggregateResultCount(object):
                  is_staff=False):
         self.answer_set = field.answer_set.none()
         self.answer_value_lookup = {}
+        cache_key = _aggregate_cache_key(survey,
+                                         request_data,
+                                         "count",
+                                         field.id,
+                                         bool(is_staff),
+                                         bool(surveyreport and
+                                              surveyreport.featured))
+        if cache_key:
+            self.answer_values = cache.get(cache_key, None)
+            if self.answer_values is not None:
+                self.yahoo_answer_string = json.dumps(self.answer_values)
+                return
+        value_column = field.value_column
         if is_staff or field.answer_is_public:
-            self.answer_set = field.public_answers
-            if is_staff:
-                self.answer_set = field.answer_set
-            self.answer_set = self.answer_set.values(field.value_column)
-            self.answer_set = self.answer_set.annotate(count=Count("id"))
-            self.answer_set = extra_from_filters(self.answer_set,
-                                                 "submission_id",
+            clauses = extra_clauses_from_filters("submission_id",
                                                  survey,
                                                  request_data)
-            if surveyreport and surveyreport.featured:
-                self.answer_set = self.answer_set.filter(
-                    submission__featured=True)
+            featured = surveyreport and surveyreport.featured
+            planned = None
+            if not (local_settings.USE_ANSWER_TALLIES and not clauses):
+                context = ReportContext.get(survey, request_data)
+                planned = context.planned_counts(field, is_staff, featured)
+            if planned is not None:
+                self.answer_set = planned
+            elif local_settings.USE_ANSWER_TALLIES and not clauses:
+                # Unfiltered, so the running tallies have the answer.
+                self.answer_set = AnswerTally.objects.filter(question=field)
+                if not is_staff:
+                    self.answer_set = self.answer_set.filter(is_public=True)
+                if featured:
+                    self.answer_set = self.answer_set.filter(featured=True)
+                self.answer_set = self.answer_set.values("value")
+                self.answer_set = self.answer_set.annotate(count=Sum("count"))
+                value_column = "value"
+            else:
+                self.answer_set = field.public_answers
+                if is_staff:
+                    self.answer_set = field.answer_set
+                self.answer_set = self.answer_set.values(value_column)
+                self.answer_set = self.answer_set.annotate(count=Count("id"))
+                for where, params in clauses:
+                    self.answer_set = self.answer_set.extra(where=[where],
+                                                            params=params)
+                if featured:
+                    self.answer_set = self.answer_set.filter(
+                        submission__featured=True)
         for answer in self.answer_set:
-            text = fill(u"%s" % answer[field.value_column], 30)
+            text = fill(u"%s" % answer[value_column], 30)
             if answer["count"]:
                 self.answer_value_lookup[text] = {
                     field.fieldname: text,
@@ -627,6 +1067,9 @@ class AggregateResultCount(object):
                 self.answer_values.append(value)
         for value in self.answer_value_lookup.values():
             self.answer_values.append(value)
+        if cache_key:
+            timeout = local_settings.REPORT_CACHE_TIMEOUT
+            cache.set(cache_key, self.answer_values, timeout)
         self.yahoo_answer_string = json.dumps(self.answer_values)
 
 
@@ -638,6 +1081,17 @@ class AggregateResult2Axis(object):
         request_data,
         aggregate_function,
         report):
+        cache_key = _aggregate_cache_key(x_axis.survey,
+                                         request_data,
+                                         aggregate_function,
+                                         x_axis.id,
+                                         [y_axis.id for y_axis in y_axes],
+                                         bool(report and report.featured))
+        if cache_key:
+            self.answer_values = cache.get(cache_key, None)
+            if self.answer_values is not None:
+                self.yahoo_answer_string = json.dumps(self.answer_values)
+                return
         self.answer_values = []
         answer_value_lookup = {}
 
@@ -654,58 +1108,172 @@ class AggregateResult2Axis(object):
         # Then doing it this way puts them in order.
         [new_answer_value(x_value) for x_value in x_axis.parsed_options]
 
-        x_value_column = "x_axis." + x_axis.value_column
-        for y_axis in y_axes:
-            params = [y_axis.id, x_axis.id]
-            y_axis_column = y_axis.value_column
-            if "boolean_answer" == y_axis_column:
-                y_axis_column = "CAST(y_axis." + y_axis_column + " AS int)"
-            else:
-                y_axis_column = "y_axis." + y_axis_column
-            query = [
-                "SELECT ",
-                x_value_column,
-                " AS x_value, ",
+        planned = None
+        if y_axes:
+            context = ReportContext.get(x_axis.survey, request_data)
+            planned = context.planned_two_axis(x_axis,
+                                               y_axes,
+                                               aggregate_function,
+                                               bool(report and
+                                                    report.featured))
+        if not y_axes:
+            queries = []
+        elif planned is not None:
+            queries = []
+        elif (local_settings.SINGLE_PASS_AGGREGATES or
+              wide.covers(x_axis.survey_id, [x_axis] + list(y_axes))):
+            queries = [self._single_pass_query(
+                y_axes,
+                x_axis,
+                request_data,
+                aggregate_function,
+                report)]
+        else:
+            queries = [self._query(
+                [y_axis],
+                x_axis,
+                request_data,
                 aggregate_function,
-                "(",
-                y_axis_column,
-                ") AS y_value FROM crowdsourcing_answer AS y_axis ",
-                "JOIN crowdsourcing_answer AS x_axis "
-                "ON y_axis.submission_id = x_axis.submission_id ",
-                "JOIN crowdsourcing_submission AS submission ",
-                "ON submission.id = y_axis.submission_id ",
-                "WHERE submission.is_public = true AND ",
-                "y_axis.question_id = %s AND ",
-                y_axis_column,
-                " IS NOT NULL AND x_axis.question_id = %s"]
-            if report and report.featured:
-                query.append(" AND submission.featured = true")
-            y = "y_axis.submission_id"
-            extras = extra_clauses_from_filters(y, x_axis.survey, request_data)
-            for where, next_params in extras:
-                query.append(" AND ")
-                query.append(where)
-                params += next_params
-            query.append(" GROUP BY ")
-            query.append(x_value_column)
+                report) for y_axis in y_axes]
+        results = []
+        if planned is not None:
+            results.append((planned, [y_axis.fieldname for y_axis in y_axes]))
+        for query, params, fieldnames in queries:
             cursor = connection.cursor()
-            cursor.execute("".join(query), params)
-            found_any = False
-            for x_value, y_value in cursor.fetchall():
+            cursor.execute(query, params)
+            results.append((cursor.fetchall(), fieldnames))
+        found_any = False
+        for rows, fieldnames in results:
+            for row in rows:
                 found_any = True
-                if isinstance(y_value, Decimal):
-                    y_value = round(y_value, 2)
+                x_value = row[0]
                 answer_value = answer_value_lookup.get(x_value)
                 if not answer_value:
                     answer_value = new_answer_value(x_value)
-                answer_value[y_axis.fieldname] += y_value
+                for fieldname, y_value in zip(fieldnames, row[1:]):
+                    if y_value is None:
+                        continue
+                    if isinstance(y_value, Decimal):
+                        y_value = round(y_value, 2)
+                    answer_value[fieldname] += y_value
         if x_axis.is_numeric:
             key = x_axis.fieldname
             self.answer_values.sort(lambda x, y: x[key] - y[key])
         if not found_any:
             self.answer_values = []
+        if cache_key:
+            timeout = local_settings.REPORT_CACHE_TIMEOUT
+            cache.set(cache_key, self.answer_values, timeout)
         self.yahoo_answer_string = json.dumps(self.answer_values)
 
+    @classmethod
+    def _y_axis_column(cls, y_axis):
+        y_axis_column = y_axis.value_column
+        if "boolean_answer" == y_axis_column:
+            return "CAST(y_axis." + y_axis_column + " AS int)"
+        return "y_axis." + y_axis_column
+
+    def _query(self, y_axes, x_axis, request_data, aggregate_function, report):
+        """ One query per y axis. """
+        y_axis = y_axes[0]
+        y_axis_column = self._y_axis_column(y_axis)
+        x_value_column = "x_axis." + x_axis.value_column
+        params = [y_axis.id, x_axis.id]
+        query = [
+            "SELECT ",
+            x_value_column,
+            " AS x_value, ",
+            aggregate_function,
+            "(",
+            y_axis_column,
+            ") AS y_value FROM crowdsourcing_answer AS y_axis ",
+            "JOIN crowdsourcing_answer AS x_axis "
+            "ON y_axis.submission_id = x_axis.submission_id ",
+            "JOIN crowdsourcing_submission AS submission ",
+            "ON submission.id = y_axis.submission_id ",
+            "WHERE submission.is_public = true AND ",
+            "y_axis.question_id = %s AND ",
+            y_axis_column,
+            " IS NOT NULL AND x_axis.question_id = %s"]
+        return self._finish_query(query,
+                                  params,
+                                  x_axis,
+                                  request_data,
+                                  bool(report and report.featured)) + (
+            [y_axis.fieldname],)
+
+    def _single_pass_query(self,
+                           y_axes,
+                           x_axis,
+                           request_data,
+                           aggregate_function,
+                           report):
+        columns = [(aggregate_function, y_axis) for y_axis in y_axes]
+        featured = bool(report and report.featured)
+        query, params = self._columns_query(columns,
+                                            x_axis,
+                                            request_data,
+                                            featured)
+        return query, params, [y_axis.fieldname for y_axis in y_axes]
+
+    @classmethod
+    def _columns_query(cls, columns, x_axis, request_data, featured):
+        """ Every y axis in one scan of the answer table. Each
+        (aggregate function, y axis) pair in columns gets its own column by
+        aggregating only the rows for its question. The other rows are NULL
+        for that column and the aggregate functions skip NULLs. Like the
+        per-axis query, it leaves out y answers that are NULL, so that an x
+        value with no y values at all doesn't get a row. """
+        y_axes = []
+        for aggregate_function, y_axis in columns:
+            if y_axis not in y_axes:
+                y_axes.append(y_axis)
+        if wide.covers(x_axis.survey_id, [x_axis] + y_axes):
+            compiled = compile_filters(x_axis.survey, request_data)
+            return wide.aggregate_query(columns, x_axis, compiled, featured)
+        x_value_column = "x_axis." + x_axis.value_column
+        query = ["SELECT ", x_value_column, " AS x_value"]
+        params = []
+        for aggregate_function, y_axis in columns:
+            query.extend([
+                ", ",
+                aggregate_function,
+                "(CASE WHEN y_axis.question_id = %s THEN ",
+                cls._y_axis_column(y_axis),
+                " END)"])
+            params.append(y_axis.id)
+        query.extend([
+            " FROM crowdsourcing_answer AS y_axis ",
+            "JOIN crowdsourcing_answer AS x_axis "
+            "ON y_axis.submission_id = x_axis.submission_id ",
+            "JOIN crowdsourcing_submission AS submission ",
+            "ON submission.id = y_axis.submission_id ",
+            "WHERE submission.is_public = true AND (",
+            " OR ".join("(y_axis.question_id = %s AND " +
+                        cls._y_axis_column(y_axis) +
+                        " IS NOT NULL)" for y_axis in y_axes),
+            ") AND x_axis.question_id = %s"])
+        params.extend([y_axis.id for y_axis in y_axes] + [x_axis.id])
+        return cls._finish_query(query,
+                                 params,
+                                 x_axis,
+                                 request_data,
+                                 featured)
+
+    @classmethod
+    def _finish_query(cls, query, params, x_axis, request_data, featured):
+        if featured:
+            query.append(" AND submission.featured = true")
+        y = "y_axis.submission_id"
+        extras = extra_clauses_from_filters(y, x_axis.survey, request_data)
+        for where, next_params in extras:
+            query.append(" AND ")
+            query.append(where)
+            params += next_params
+        query.append(" GROUP BY ")
+        query.append("x_axis." + x_axis.value_column)
+        return "".join(query), params
+
 
 class AggregateResultSum(AggregateResult2Axis):
     def __init__(self, y_axes, x_axis, request_data, report=None):
@@ -746,6 +1314,28 @@ class Submission(models.Model):
     class Meta:
         ordering = ('-submitted_at',)
 
+    def save(self, **kwargs):
+        old_flags = None
+        if self.pk:
+            old_flags = list(Submission.objects.filter(pk=self.pk).values_list(
+                "is_public",
+                "featured"))
+        super(Submission, self).save(**kwargs)
+        if not old_flags:
+            _adjust_survey_counts(self.survey_id,
+                                  1,
+                                  1 if self.is_public else 0,
+                                  self.submitted_at)
+            return
+        was_public, was_featured = old_flags[0]
+        if was_public != self.is_public:
+            _adjust_survey_counts(self.survey_id,
+                                  0,
+                                  1 if self.is_public else -1)
+        if (local_settings.USE_ANSWER_TALLIES and
+            (was_public, was_featured) != (self.is_public, self.featured)):
+            AnswerTally.move_submission(self, was_public, was_featured)
+
     def to_jsondata(self, answer_lookup=None, include_private_questions=False):
         def to_json(v):
             if isinstance(v, ImageFieldFile):
@@ -810,14 +1400,36 @@ class Answer(models.Model):
         thumbnail=image_answer_thumbnail_meta,
         extra_thumbnails=local_settings.EXTRA_THUMBNAILS,
         upload_to=local_settings.IMAGE_UPLOAD_PATTERN)
-    latitude = models.FloatField(blank=True, null=True)
-    longitude = models.FloatField(blank=True, null=True)
+    # Filled in as photos come in, so pages showing them needn't open the
+    # file. ./manage.py backfill_image_dimensions does older photos. Not
+    # ImageField's width_field and height_field, which would open the file
+    # whenever an answer loads without them.
+    image_width = models.IntegerField(blank=True, null=True, editable=False)
+    image_height = models.IntegerField(blank=True, null=True, editable=False)
+    latitude = models.FloatField(blank=True, null=True, db_index=True)
+    longitude = models.FloatField(blank=True, null=True, db_index=True)
+    # Location answers wait here for Answer.geocode_pending_answers when
+    # settings.SYNCHRONOUS_GEOCODING is False.
+    geocode_pending = models.BooleanField(default=False,
+                                          db_index=True,
+                                          editable=False)
 
     flickr_id = models.CharField(max_length=64, blank=True)
+    # The SHA-1 of image_answer. forms.PhotoUpload works it out as the
+    # photo comes in. Empty means the photo changed since anyone hashed it.
     photo_hash = models.CharField(max_length=40,
                                   null=True,
                                   blank=True,
+                                  db_index=True,
                                   editable=False)
+    # JSON of the url, width and height of each size of thumbnail, so that
+    # pages showing photos never resize one. See Answer.make_thumbnails.
+    thumbnails = models.TextField(blank=True, editable=False)
+    # Photos wait here for Answer.make_pending_thumbnails when
+    # settings.SYNCHRONOUS_THUMBNAILS is False.
+    thumbnails_pending = models.BooleanField(default=False,
+                                             db_index=True,
+                                             editable=False)
 
     def value():
         def get(self):
@@ -851,37 +1463,592 @@ class Answer(models.Model):
         ordering = ('question',)
 
     def save(self, **kwargs):
-        # or should this be in a signal?  Or build in an option
-        # to manage asynchronously? @TBD
+        # A new photo whose old version is on Flickr.
+        replace_on_flickr = False
+        if self.pk and (self.photo_hash or self.thumbnails):
+            old = Answer.objects.filter(pk=self.pk)
+            old_rows = list(old.values_list("image_answer", "photo_hash"))
+            if old_rows and old_rows[0][0] != self.image_answer.name:
+                old_hash = old_rows[0][1]
+                # PhotoUpload hashes uploads as they come in. Otherwise
+                # nobody knows the new photo's hash yet.
+                fresh = self.image_answer and not self.image_answer._committed
+                if not (fresh and self.photo_hash):
+                    self.photo_hash = None
+                elif self.flickr_id and self.photo_hash != old_hash:
+                    replace_on_flickr = True
+                self.thumbnails = ""
+                self.__dict__.pop("_thumbnails", None)
+                self.image_width = self.image_height = None
+        if self.image_answer and not self.image_answer._committed:
+            # A new upload, still in memory or a temporary file.
+            self.set_image_dimensions(self.image_answer)
+        elif not self.image_answer:
+            self.image_width = self.image_height = None
+        if self.image_answer and not self.thumbnails:
+            self.thumbnails_pending = True
+        # Otherwise FlickrUpload.process_queue syncs the photo later.
         if local_settings.SYNCHRONOUS_FLICKR_UPLOAD:
-            self._sync_self_to_flickr()
+            synced = self._sync_self_to_flickr(replace_on_flickr)
+            if replace_on_flickr and not synced:
+                # Leave it looking out of sync so that it tries again.
+                self.photo_hash = None
+        old_key = None
+        if self.pk and local_settings.USE_ANSWER_TALLIES:
+            try:
+                old = Answer.objects.select_related("question", "submission")
+                old_key = old.get(pk=self.pk).tally_key()
+            except Answer.DoesNotExist:
+                pass
         super(Answer, self).save(**kwargs)
+        if local_settings.USE_ANSWER_TALLIES:
+            new_key = self.tally_key()
+            if old_key != new_key:
+                deltas = {new_key: 1}
+                if old_key:
+                    deltas[old_key] = -1
+                AnswerTally.adjust(deltas)
+        if not local_settings.SYNCHRONOUS_FLICKR_UPLOAD:
+            OTC = OPTION_TYPE_CHOICES
+            if OTC.PHOTO == self.question.option_type:
+                if replace_on_flickr or self.needs_flickr_sync():
+                    if self.question.survey.flickr_group_id:
+                        FlickrUpload.enqueue([self], replace_on_flickr)
+        if self.thumbnails_pending and local_settings.SYNCHRONOUS_THUMBNAILS:
+            Answer.make_thumbnails([self])
 
     def __unicode__(self):
         return unicode(self.question)
 
-    def _sync_self_to_flickr(self):
-        """ Does not save. You must save after syncing. """
-        if sync_to_flickr:
-            survey = self.question.survey
-            if survey.flickr_group_id:
-                try:
-                    sync_to_flickr(self, survey.flickr_group_id)
-                except Exception as ex:
-                    message = "error in syncing to flickr: %s" % str(ex)
-                    logging.exception(message)
+    def tally_key(self):
+        """ The AnswerTally row this answer counts towards. """
+        return (self.question_id,
+                u"%s" % self.value,
+                bool(self.submission.is_public),
+                bool(self.submission.featured))
+
+    def set_image_dimensions(self, image):
+        """ image can be any Django File. Leaves the dimensions empty if it
+        isn't an image we can read. """
+        try:
+            self.image_width, self.image_height = get_image_dimensions(image)
+        except (IOError, TypeError, ValueError):
+            self.image_width = self.image_height = None
+
+    def get_thumbnail(self, name="default"):
+        """ The url, width and height of a thumbnail that make_thumbnails
+        made, or None. name is "default" or a key of EXTRA_THUMBNAILS. """
+        if not self.thumbnails:
+            return None
+        if not "_thumbnails" in self.__dict__:
+            self.__dict__["_thumbnails"] = json.loads(self.thumbnails)
+        return self.__dict__["_thumbnails"].get(name)
+
+    @classmethod
+    def make_thumbnails(cls, answers, workers=None):
+        """ Make every size of thumbnail for photo answers, several at a
+        time, and record their urls and dimensions. Returns how many answers
+        it made thumbnails for. """
+        workers = workers or local_settings.THUMBNAIL_WORKERS
+        photos = [a for a in answers if a.image_answer]
+        results = []
+        if photos:
+            pool = ThreadPool(min(workers, len(photos)))
+            try:
+                results = pool.map(_make_thumbnails,
+                                   [a.image_answer for a in photos])
+            finally:
+                pool.close()
+                pool.join()
+        for answer, thumbnails in zip(photos, results):
+            answer.thumbnails = json.dumps(thumbnails) if thumbnails else ""
+            answer.__dict__.pop("_thumbnails", None)
+            cls.objects.filter(pk=answer.pk).update(
+                thumbnails=answer.thumbnails,
+                thumbnails_pending=False)
+        # Even if it failed, so they don't clog up every batch. Pages fall
+        # back on making the thumbnails themselves.
+        for answer in answers:
+            answer.thumbnails_pending = False
+        cls.objects.filter(pk__in=[a.pk for a in answers]).update(
+            thumbnails_pending=False)
+        return len([r for r in results if r])
+
+    @classmethod
+    def make_pending_thumbnails(cls, batch_size=100):
+        """ Make the thumbnails for a batch of photos that were saved
+        without them. Returns how many photos it tried. """
+        pending = cls.objects.filter(thumbnails_pending=True)
+        pending = list(pending[:batch_size])
+        cls.make_thumbnails(pending)
+        return len(pending)
+
+    def needs_flickr_sync(self):
+        if self.image_answer:
+            return not (self.flickr_id and self.photo_hash)
+        return bool(self.flickr_id or self.photo_hash)
+
+    def reuse_identical_flickr_photo(self, group_id):
+        """ If somebody already put the very same photo in the Flickr group,
+        point this answer at their Flickr photo rather than uploading another
+        copy. Returns whether it did. """
+        if self.flickr_id or not (self.photo_hash and self.image_answer):
+            return False
+        same = Answer.objects.filter(
+            photo_hash=self.photo_hash,
+            question__survey__flickr_group_id=group_id)
+        same = same.exclude(flickr_id='').exclude(pk=self.pk)
+        flickr_ids = list(same.values_list("flickr_id", flat=True)[:1])
+        if flickr_ids:
+            self.flickr_id = flickr_ids[0]
+        return bool(flickr_ids)
+
+    def shares_flickr_photo(self):
+        if not self.flickr_id:
+            return False
+        same = Answer.objects.filter(flickr_id=self.flickr_id)
+        return same.exclude(pk=self.pk).exists()
+
+    def _sync_self_to_flickr(self, replace=False):
+        """ Does not save. You must save after syncing. replace means the
+        photo changed since it went to Flickr, even though it has a hash.
+        Returns whether the answer is in sync. """
+        if not (replace or self.needs_flickr_sync()):
+            return True
+        if not flickr_available():
+            return False
+        survey = self.question.survey
+        if not survey.flickr_group_id:
+            return True
+        if not replace and self.reuse_identical_flickr_photo(
+                survey.flickr_group_id):
+            return True
+        try:
+            sync_to_flickr(self,
+                           survey.flickr_group_id,
+                           self.shares_flickr_photo(),
+                           replace)
+        except Exception as ex:
+            message = "error in syncing to flickr: %s" % str(ex)
+            logging.exception(message)
+            return False
+        return True
+
+    @classmethod
+    def geocode_pending_answers(cls, batch_size=100):
+        """ Fill in the latitude and longitude of location answers that
+        were saved without them. Geocodes each distinct location in the
+        batch once. Returns how many answers it resolved. """
+        pending = cls.objects.filter(geocode_pending=True)
+        pending = pending.values_list("id", "text_answer")[:batch_size]
+        ids_by_location = {}
+        for id, location in pending:
+            ids_by_location.setdefault(location, []).append(id)
+        submission_ids = {}
+        for location, ids in ids_by_location.items():
+            lat, lng = get_latitude_and_longitude(location)
+            # Even when the geocoder comes up empty we stop waiting on it.
+            # Otherwise unknown locations would clog up every batch.
+            cls.objects.filter(pk__in=ids).update(latitude=lat,
+                                                  longitude=lng,
+                                                  geocode_pending=False)
+            answers = cls.objects.filter(pk__in=ids)
+            for survey_id, submission_id in answers.values_list(
+                    "submission__survey_id", "submission_id"):
+                submission_ids.setdefault(survey_id, set()).add(submission_id)
+        for survey_id, ids in submission_ids.items():
+            bump_survey_version(survey_id)
+            if wide.is_maintained(survey_id):
+                wide.refresh(survey_id, ids)
+        return sum(len(ids) for ids in ids_by_location.values())
 
     @classmethod
     def sync_to_flickr(cls):
-        if sync_to_flickr:
+        """ Queue any photos that never made it to Flickr, then upload
+        everything in the queue that's due. """
+        if flickr_available():
             answers = cls.objects.filter(
                 image_answer__gt='',
                 flickr_id='',
+                flickrupload__isnull=True,
                 question__survey__flickr_group_id__gt='')
-            answers = answers.select_related("question__survey")
-            for answer in answers:
-                answer._sync_self_to_flickr()
-                answer.save()
+            FlickrUpload.enqueue(list(answers.only("id")))
+            while FlickrUpload.process_queue():
+                pass
+
+
+def process_new_answers(submission, answers):
+    """ The side effects of new answers inserted in bulk, which bypasses
+    Answer.save. Call this once the answers have committed so the slow
+    parts, geocoding and syncing photos to Flickr, don't hold a transaction
+    open. """
+    if local_settings.USE_ANSWER_TALLIES:
+        deltas = {}
+        for answer in answers:
+            key = answer.tally_key()
+            deltas[key] = deltas.get(key, 0) + 1
+        AnswerTally.adjust(deltas)
+    OTC = OPTION_TYPE_CHOICES
+    located = [a.question_id for a in answers
+               if a.question.option_type == OTC.LOCATION]
+    photo_ids = [a.question_id for a in answers
+                 if a.question.option_type == OTC.PHOTO and a.image_answer]
+    photos = []
+    if submission.survey.flickr_group_id:
+        photos = photo_ids
+    if photo_ids:
+        pending = submission.answer_set.filter(question__id__in=photo_ids)
+        if local_settings.SYNCHRONOUS_THUMBNAILS:
+            Answer.make_thumbnails(list(pending))
+        else:
+            pending.update(thumbnails_pending=True)
+    if photos and not local_settings.SYNCHRONOUS_FLICKR_UPLOAD:
+        queued = submission.answer_set.filter(question__id__in=photos)
+        FlickrUpload.enqueue(list(queued.only("id")))
+        photos = []
+    if located and not local_settings.SYNCHRONOUS_GEOCODING:
+        pending = submission.answer_set.filter(question__id__in=located)
+        pending.exclude(text_answer="").update(geocode_pending=True)
+        located = []
+    if located or photos:
+        _process_new_locations_and_photos(submission, located, photos)
+    if wide.is_maintained(submission.survey_id):
+        wide.refresh(submission.survey_id, [submission.id])
+    bump_survey_version(submission.survey_id)
+
+
+def _process_new_locations_and_photos(submission, located, photos):
+    # bulk_create doesn't give us primary keys, so go back for the answers.
+    saved = submission.answer_set.filter(question__id__in=located + photos)
+    saved = saved.select_related("question__survey")
+    lat_lng_lookup = {}
+    for answer in saved:
+        if answer.question_id in located and answer.text_answer:
+            location = answer.text_answer
+            if not location in lat_lng_lookup:
+                lat_lng_lookup[location] = get_latitude_and_longitude(location)
+            lat, lng = lat_lng_lookup[location]
+            Answer.objects.filter(pk=answer.pk).update(latitude=lat,
+                                                       longitude=lng)
+        elif answer.question_id in photos:
+            answer._sync_self_to_flickr()
+            Answer.objects.filter(pk=answer.pk).update(
+                flickr_id=answer.flickr_id,
+                photo_hash=answer.photo_hash)
+
+
+def _answer_pre_delete(sender, instance, **kwargs):
+    if local_settings.USE_ANSWER_TALLIES:
+        try:
+            key = instance.tally_key()
+        except (Question.DoesNotExist, Submission.DoesNotExist):
+            return
+        AnswerTally.adjust({key: -1})
+pre_delete.connect(_answer_pre_delete, sender=Answer)
+
+
+# The surveys this thread is deleting. Deleting a survey cascades to its
+# submissions, and there's no point in keeping its counts up to date.
+_deleting = threading.local()
+
+
+def _survey_is_being_deleted(survey_id):
+    return survey_id in getattr(_deleting, "survey_ids", ())
+
+
+def _survey_pre_delete(sender, instance, **kwargs):
+    if not hasattr(_deleting, "survey_ids"):
+        _deleting.survey_ids = set()
+    _deleting.survey_ids.add(instance.pk)
+pre_delete.connect(_survey_pre_delete, sender=Survey)
+
+
+def _survey_post_delete(sender, instance, **kwargs):
+    getattr(_deleting, "survey_ids", set()).discard(instance.pk)
+post_delete.connect(_survey_post_delete, sender=Survey)
+
+
+def _submission_post_delete(sender, instance, **kwargs):
+    if _survey_is_being_deleted(instance.survey_id):
+        return
+    _adjust_survey_counts(instance.survey_id,
+                          -1,
+                          -1 if instance.is_public else 0)
+    # Only the survey's latest submission moves last_submitted_at. Django
+    # sends post_delete once the whole batch is gone, so a bulk delete
+    # finds the new latest submission on the first pass and the rest of the
+    # batch skips this.
+    # Some databases drop the microseconds.
+    submitted_at = instance.submitted_at
+    surveys = Survey.objects.filter(
+        pk=instance.survey_id,
+        last_submitted_at__range=(submitted_at.replace(microsecond=0),
+                                  submitted_at))
+    if surveys.exists():
+        submissions = Submission.objects.filter(survey__id=instance.survey_id)
+        last = submissions.aggregate(last=Max("submitted_at"))["last"]
+        surveys.update(last_submitted_at=last)
+post_delete.connect(_submission_post_delete, sender=Submission)
+
+
+class AnswerTally(models.Model):
+    """ A running count of the answers to a question that share a value,
+    split up by the moderation flags of their submissions. Unfiltered pie
+    charts read these rows rather than grouping the entire answer table. Only
+    maintained when settings.CROWDSOURCING_USE_ANSWER_TALLIES is True. Run
+    ./manage.py rebuild_answer_tallies after turning that setting on. """
+    question = models.ForeignKey(Question)
+    value = models.TextField(blank=True)
+    is_public = models.BooleanField(default=True)
+    featured = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+
+    def __unicode__(self):
+        return u"%s: %s" % (self.value, self.count)
+
+    @classmethod
+    def adjust(cls, deltas):
+        """ deltas maps (question_id, value, is_public, featured) keys, as
+        returned by Answer.tally_key, to the change in count. """
+        for key, delta in deltas.items():
+            if not delta:
+                continue
+            question_id, value, is_public, featured = key
+            tallies = cls.objects.filter(question__id=question_id,
+                                         value=value,
+                                         is_public=is_public,
+                                         featured=featured)
+            if not tallies.update(count=F("count") + delta):
+                cls.objects.create(question_id=question_id,
+                                   value=value,
+                                   is_public=is_public,
+                                   featured=featured,
+                                   count=delta)
+
+    @classmethod
+    def move_submission(cls, submission, was_public, was_featured):
+        """ The submission was moderated. Move its answers from the tallies
+        for its old flags to the tallies for its new ones. """
+        deltas = {}
+        old_flags = (bool(was_public), bool(was_featured))
+        new_flags = (bool(submission.is_public), bool(submission.featured))
+        for answer in submission.answer_set.select_related("question"):
+            value = (answer.question_id, u"%s" % answer.value)
+            deltas[value + old_flags] = deltas.get(value + old_flags, 0) - 1
+            deltas[value + new_flags] = deltas.get(value + new_flags, 0) + 1
+        cls.adjust(deltas)
+
+    @classmethod
+    def rebuild(cls, questions):
+        for question in questions:
+            cls.objects.filter(question=question).delete()
+            column = question.value_column
+            rows = question.answer_set.order_by().values(
+                column,
+                "submission__is_public",
+                "submission__featured").annotate(count=Count("id"))
+            cls.objects.bulk_create([cls(
+                question=question,
+                value=u"%s" % row[column],
+                is_public=row["submission__is_public"],
+                featured=row["submission__featured"],
+                count=row["count"]) for row in rows])
+
+
+def _make_thumbnails(image):
+    """ Runs in Answer.make_thumbnails' worker threads, so it mustn't touch
+    the database. Returns the details of every size of thumbnail of image,
+    or None if sorl couldn't make them. """
+    if not hasattr(image, "thumbnail"):
+        # sorl.thumbnail isn't installed.
+        return None
+    try:
+        thumbnails = dict(image.extra_thumbnails)
+        thumbnails["default"] = image.thumbnail
+        return dict((name, dict(url=t.absolute_url,
+                                width=t.width(),
+                                height=t.height()))
+                    for name, t in thumbnails.items())
+    except Exception as ex:
+        logging.exception("error making thumbnails for %s: %s" % (
+            image.name, str(ex)))
+        return None
+
+
+class FlickrUpload(models.Model):
+    """ A photo answer waiting for FlickrUpload.process_queue to sync it to
+    Flickr, when settings.SYNCHRONOUS_FLICKR_UPLOAD is False. Failed uploads
+    stay here with the error and try again later, backing off each time.
+    next_attempt_at is empty once an upload has used up its attempts. """
+    answer = models.OneToOneField(Answer)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True,
+                                           blank=True,
+                                           db_index=True,
+                                           default=datetime.datetime.now)
+    last_error = models.TextField(blank=True)
+    queued_at = models.DateTimeField(default=datetime.datetime.now)
+    # The answer has a new photo, with its hash, in place of one on Flickr.
+    replace = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('next_attempt_at',)
+
+    def __unicode__(self):
+        return u"%s" % self.answer_id
+
+    @classmethod
+    def enqueue(cls, answers, replace=False):
+        """ Queue answers to sync right away. Answers that are already
+        queued, or gave up, start over. Pass replace when the answers have
+        new photos, with hashes, in place of photos on Flickr. """
+        ids = [answer.pk for answer in answers]
+        if not ids:
+            return
+        now = datetime.datetime.now()
+        queued = cls.objects.filter(answer__id__in=ids)
+        updates = dict(attempts=0, next_attempt_at=now, last_error="")
+        if replace:
+            updates["replace"] = True
+        queued.update(**updates)
+        existing = set(queued.values_list("answer_id", flat=True))
+        cls.objects.bulk_create([cls(answer_id=id,
+                                     next_attempt_at=now,
+                                     replace=replace)
+                                 for id in ids if id not in existing])
+
+    @classmethod
+    def process_queue(cls, batch_size=None, workers=None):
+        """ Sync a batch of the uploads that are due, several at a time.
+        Returns how many it tried. Safe to run in more than one process at
+        once, since each claims its batch before uploading. """
+        if not flickr_available():
+            return 0
+        batch_size = batch_size or local_settings.FLICKR_UPLOAD_BATCH_SIZE
+        workers = workers or local_settings.FLICKR_UPLOAD_WORKERS
+        now = datetime.datetime.now()
+        due = cls.objects.filter(next_attempt_at__lte=now)
+        due = due.select_related("answer__question__survey")[:batch_size]
+        # Push each upload into the future so nobody else picks it up. If
+        # this process dies mid-upload the upload tries again after that.
+        claim_until = now + datetime.timedelta(
+            seconds=local_settings.FLICKR_UPLOAD_RETRY_DELAY)
+        claimed = []
+        for upload in due:
+            mine = cls.objects.filter(pk=upload.pk,
+                                      next_attempt_at=upload.next_attempt_at)
+            if mine.update(next_attempt_at=claim_until):
+                upload.next_attempt_at = claim_until
+                claimed.append(upload)
+        if not claimed:
+            return 0
+        # The database work happens here, so the threads only talk to Flickr.
+        uploading = []
+        jobs = []
+        for upload in claimed:
+            answer = upload.answer
+            group_id = answer.question.survey.flickr_group_id
+            needs_sync = upload.replace or answer.needs_flickr_sync()
+            if not group_id or not needs_sync:
+                upload.succeeded()
+            elif (not upload.replace and
+                  answer.reuse_identical_flickr_photo(group_id)):
+                upload.succeeded()
+            else:
+                uploading.append(upload)
+                jobs.append((answer,
+                             answer.shares_flickr_photo(),
+                             upload.replace))
+        errors = []
+        if jobs:
+            pool = ThreadPool(min(workers, len(jobs)))
+            try:
+                errors = pool.map(_upload_to_flickr, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        for upload, error in zip(uploading, errors):
+            if error:
+                upload.failed(error)
+            else:
+                upload.succeeded()
+        return len(claimed)
+
+    def _claimed(self):
+        """ This upload's row, unless someone saved the answer again while
+        we were uploading it. enqueue resets next_attempt_at, which
+        process_queue set to its claim. """
+        return FlickrUpload.objects.filter(
+            pk=self.pk,
+            next_attempt_at=self.next_attempt_at)
+
+    def succeeded(self):
+        answer = self.answer
+        # Don't record the old photo's Flickr id against a new photo.
+        unchanged = Answer.objects.filter(
+            pk=answer.pk,
+            image_answer=answer.image_answer.name or "")
+        unchanged.update(flickr_id=answer.flickr_id,
+                         photo_hash=answer.photo_hash)
+        self._claimed().delete()
+
+    def failed(self, error):
+        attempts = self.attempts + 1
+        logging.error("error in syncing answer %s to flickr, attempt %d: %s",
+                      self.answer_id,
+                      attempts,
+                      error)
+        next_attempt_at = None
+        if attempts < local_settings.FLICKR_UPLOAD_MAX_ATTEMPTS:
+            delay = local_settings.FLICKR_UPLOAD_RETRY_DELAY
+            delay *= 2 ** (attempts - 1)
+            next_attempt_at = (datetime.datetime.now() +
+                               datetime.timedelta(seconds=delay))
+        self._claimed().update(attempts=attempts,
+                               last_error=error,
+                               next_attempt_at=next_attempt_at)
+
+
+def _upload_to_flickr(job):
+    """ Runs in FlickrUpload.process_queue's worker threads, so it mustn't
+    touch the database. answer.question.survey is already loaded. Returns
+    the error, if any. """
+    answer, shared, replace = job
+    try:
+        sync_to_flickr(answer,
+                       answer.question.survey.flickr_group_id,
+                       shared,
+                       replace)
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+class GeocodedLocation(models.Model):
+    """ Every location the geocoder has found, so we only ever geocode a
+    location once. crowdsourcing.geo.get_latitude_and_longitude reads and
+    writes this table. location is normalized with
+    crowdsourcing.geo.normalize_location. """
+    MAX_LENGTH = 255
+    location = models.CharField(max_length=MAX_LENGTH, unique=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geocoded_at = models.DateTimeField(default=datetime.datetime.now)
+
+    def __unicode__(self):
+        return self.location
+
+    @classmethod
+    def remember(cls, location, lat_lng):
+        lat, lng = lat_lng
+        # Another process may have beaten us to it, which is fine.
+        if not cls.objects.filter(location=location).exists():
+            try:
+                cls.objects.create(location=location,
+                                   latitude=lat,
+                                   longitude=lng)
+            except IntegrityError:
+                pass
 
 
 class SurveyReport(models.Model):
@@ -1051,6 +2218,36 @@ class SurveyReportDisplay(models.Model):
     def get_caption_fieldnames(self):
         return self.caption_fields.split(" ")
 
+    def slide_answers(self, question, request_data, is_staff=False):
+        """ The photo answers a slideshow of question shows, newest first,
+        so that a window of slides is the same from one request to the
+        next. Only staff see photos from submissions that aren't public. """
+        answers = question.answer_set.order_by("-submission__submitted_at",
+                                               "-id")
+        if not is_staff:
+            answers = answers.filter(submission__is_public=True)
+        return extra_from_filters(answers,
+                                  "submission_id",
+                                  self.get_report().survey,
+                                  request_data)
+
+    def slide_captions(self, answers):
+        """ The public caption answers for just the submissions in answers,
+        in a dict by submission id. """
+        fieldnames = filter(None, self.get_caption_fieldnames())
+        submission_ids = set(answer.submission_id for answer in answers)
+        if not fieldnames or not submission_ids:
+            return {}
+        captions = Answer.objects.filter(
+            question__fieldname__in=fieldnames,
+            question__survey=self.get_report().survey_id,
+            submission__is_public=True,
+            submission__in=submission_ids).select_related("question")
+        lookup = {}
+        for caption in captions:
+            lookup.setdefault(caption.submission_id, []).append(caption)
+        return lookup
+
     def _get_questions(self, fieldnames, fields):
         names = fieldnames.split(" ")
         if fields:
@@ -1084,16 +2281,143 @@ class SurveyReportDisplay(models.Model):
         return super(SurveyReportDisplay, self).__getattribute__(key)
 
 
-def get_all_answers(submission_list, include_private_questions=False):
-    ids = [submission.id for submission in submission_list]
-    page_answers_list = Answer.objects.filter(submission__id__in=ids)
-    if not include_private_questions:
-        kwargs = dict(question__answer_is_public=True)
-        page_answers_list = page_answers_list.filter(**kwargs)
-    page_answers_list = page_answers_list.select_related("question")
+def _survey_id_of(instance):
+    if isinstance(instance, Survey):
+        return instance.pk
+    elif isinstance(instance, Answer):
+        return instance.submission.survey_id
+    elif isinstance(instance, SurveyReportDisplay):
+        return instance.report.survey_id
+    return instance.survey_id
+
+
+def _bump_results_version(sender, instance, **kwargs):
+    """ Anything that changes what a report shows orphans the cached
+    reports and aggregates for its survey. """
+    try:
+        survey_id = _survey_id_of(instance)
+    except ObjectDoesNotExist:
+        return
+    if survey_id and (isinstance(instance, Survey) or
+                      not _survey_is_being_deleted(survey_id)):
+        bump_survey_version(survey_id)
+# Not Answer. A submission or survey delete cascades to hundreds of answers,
+# and new answers go through process_new_answers, which bumps once for all of
+# them. SubmissionAdmin bumps after staff edit a submission's answers.
+for model in (Survey,
+              Question,
+              Submission,
+              SurveyReport,
+              SurveyReportDisplay):
+    post_save.connect(_bump_results_version, sender=model)
+    post_delete.connect(_bump_results_version, sender=model)
+
+
+def _bump_schema_version(sender, instance, **kwargs):
+    survey_id = _survey_id_of(instance)
+    if survey_id:
+        bump_survey_version(survey_id, "schema")
+for model in (Survey, Question):
+    post_save.connect(_bump_schema_version, sender=model)
+    post_delete.connect(_bump_schema_version, sender=model)
+
+
+def _wide_table_post_save(sender, instance, **kwargs):
+    """ Keeps wide tables up to date. Connected after _bump_schema_version
+    so that wide.is_maintained sees the latest questions. New submissions
+    get their rows from process_new_answers, once all their answers are in.
+    """
+    if not wide.wide_survey_ids():
+        # Don't look up the survey of every answer for nothing.
+        return
+    try:
+        survey_id = _survey_id_of(instance)
+    except ObjectDoesNotExist:
+        return
+    if not survey_id or not wide.is_maintained(survey_id):
+        return
+    if isinstance(instance, Question):
+        wide.check_columns(survey_id)
+    elif isinstance(instance, Answer):
+        wide.refresh(survey_id, [instance.submission_id])
+    elif not kwargs["created"]:
+        wide.refresh(survey_id, [instance.pk])
+for model in (Question, Submission, Answer):
+    post_save.connect(_wide_table_post_save, sender=model)
+
+
+def _wide_table_post_delete(sender, instance, **kwargs):
+    if isinstance(instance, Survey):
+        if instance.use_wide_table:
+            wide.drop(instance.pk)
+            wide.changed_wide_surveys()
+        return
+    if not wide.wide_survey_ids():
+        return
+    try:
+        survey_id = _survey_id_of(instance)
+    except ObjectDoesNotExist:
+        return
+    if (not survey_id or _survey_is_being_deleted(survey_id) or
+        not wide.is_maintained(survey_id)):
+        return
+    if isinstance(instance, Submission):
+        wide.delete(survey_id, [instance.pk])
+    elif isinstance(instance, Answer):
+        wide.refresh(survey_id, [instance.submission_id])
+    # Leftover columns for a deleted question don't hurt.
+for model in (Survey, Question, Submission, Answer):
+    post_delete.connect(_wide_table_post_delete, sender=model)
+
+
+def _bump_sites_version(sender, instance, **kwargs):
+    bump_version(SITES_VERSION_KEY)
+post_save.connect(_bump_sites_version, sender=Site)
+post_delete.connect(_bump_sites_version, sender=Site)
+
+
+def iter_answers(submission_list,
+                 include_private_questions=False,
+                 questions=None,
+                 chunk_size=None):
+    """ Yields (submission_id, answers) for every submission in
+    submission_list, in order. submission_list can hold submissions or their
+    ids and can be any iterable, even a generator. Loads the answers for
+    chunk_size submissions at a time, so the IN lists stay a reasonable size.
+    If you pass questions, only load the answers to those questions, and
+    only the value columns they need. """
+    chunk_size = chunk_size or local_settings.ANSWER_QUERY_CHUNK_SIZE
+    submission_ids = (getattr(s, "id", s) for s in submission_list)
+    columns = None
+    if questions is not None:
+        columns = set(q.value_column for q in questions)
+        columns.update(["id", "submission", "question"])
+        if "image_answer" in columns:
+            columns.update(["thumbnails", "image_width", "image_height"])
+    while True:
+        ids = list(islice(submission_ids, chunk_size))
+        if not ids:
+            return
+        answers = Answer.objects.filter(submission__id__in=ids)
+        if not include_private_questions:
+            answers = answers.filter(question__answer_is_public=True)
+        if columns:
+            answers = answers.filter(question__in=questions).only(*columns)
+        answers = answers.select_related("question")
+        lookup = {}
+        for answer in answers:
+            lookup.setdefault(answer.submission_id, []).append(answer)
+        for id in ids:
+            yield id, lookup.get(id, [])
+
+
+def get_all_answers(submission_list,
+                    include_private_questions=False,
+                    questions=None):
     page_answers = {}
-    for answer in page_answers_list:
-        if not answer.submission_id in page_answers:
-            page_answers[answer.submission_id] = []
-        page_answers[answer.submission_id].append(answer)
+    for submission_id, answers in iter_answers(submission_list,
+                                               include_private_questions,
+                                               questions):
+        if answers:
+            page_answers[submission_id] = answers
     return page_answers
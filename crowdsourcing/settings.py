@@ -137,3 +137,126 @@ ALL_STAFF_EMAIL_NOTIFICATION = getattr(
     _gs,
     'CROWDSOURCING_ALL_STAFF_EMAIL_NOTIFICATION',
     True)
+
+
+# Keep running per-question answer counts in the AnswerTally table so that
+# unfiltered pie charts don't have to group the whole answer table on every
+# report view. If you turn this on for a site with existing submissions, run
+# ./manage.py rebuild_answer_tallies afterwards.
+USE_ANSWER_TALLIES = getattr(_gs, 'CROWDSOURCING_USE_ANSWER_TALLIES', False)
+
+
+# Bar and line charts compute every y-axis series in a single query rather
+# than one query per y-axis. Set this to False to go back to one query per
+# y-axis.
+SINGLE_PASS_AGGREGATES = getattr(_gs,
+                                 'CROWDSOURCING_SINGLE_PASS_AGGREGATES',
+                                 True)
+
+
+# How many seconds to cache rendered survey reports and the aggregate results
+# behind their charts. Cached results are keyed by the survey, report, page,
+# filters and whether the user is staff. New submissions, moderation, and
+# edits to the survey or its reports invalidate them. 0 turns off caching.
+REPORT_CACHE_TIMEOUT = getattr(_gs, 'CROWDSOURCING_REPORT_CACHE_TIMEOUT', 0)
+
+
+# Geocoding location answers synchronously means the submit request waits on
+# the geocoder. If you set this to False, crowdsourcing saves location answers
+# without coordinates and Answer.geocode_pending_answers() fills them in
+# later. crowdsourcing/tasks.py attempts to set up a celery task for that.
+SYNCHRONOUS_GEOCODING = getattr(_gs,
+                                'CROWDSOURCING_SYNCHRONOUS_GEOCODING',
+                                True)
+
+
+# Use the form path.to.my_function for a custom def geocode(location) that
+# returns a (latitude, longitude) tuple, or (None, None) for unknown
+# locations. The default uses geopy's Google geocoder.
+GEOCODER = getattr(_gs, 'CROWDSOURCING_GEOCODER', '')
+
+
+# Geocoder results live in the GeocodedLocation table. This many of the most
+# recently used locations are also kept in memory in each process.
+GEOCODE_CACHE_SIZE = getattr(_gs, 'CROWDSOURCING_GEOCODE_CACHE_SIZE', 1000)
+
+
+# Streaming exports from the submissions API (stream=true) load this many
+# submissions and their answers at a time.
+EXPORT_CHUNK_SIZE = getattr(_gs, 'CROWDSOURCING_EXPORT_CHUNK_SIZE', 500)
+
+
+# crowdsourcing.models.get_all_answers and iter_answers look up the answers
+# for at most this many submissions per query, so that exporting a big survey
+# doesn't produce a query with an enormous IN list.
+ANSWER_QUERY_CHUNK_SIZE = getattr(_gs,
+                                  'CROWDSOURCING_ANSWER_QUERY_CHUNK_SIZE',
+                                  500)
+
+
+# Cache each survey's questions, in this process and in Django's cache, until
+# the survey or one of its questions changes. Only turn this on if every
+# process shares CACHE_BACKEND, as with memcached. With a per-process cache
+# such as the default locmem, an edit only reaches the process that made it.
+CACHE_SURVEY_SCHEMA = getattr(_gs, 'CROWDSOURCING_CACHE_SURVEY_SCHEMA', False)
+
+# How long, in seconds, Django's cache holds a survey's questions.
+SURVEY_SCHEMA_TIMEOUT = getattr(_gs,
+                                'CROWDSOURCING_SURVEY_SCHEMA_TIMEOUT',
+                                24 * 60 * 60)
+
+
+# Caches such as a CDN may hold on to anonymous API responses, i.e. questions,
+# embedded reports, location question results, and survey exports, for this
+# many seconds. Either way those responses carry an ETag and a Last-Modified
+# header so that clients can check back cheaply.
+API_CACHE_MAX_AGE = getattr(_gs, 'CROWDSOURCING_API_CACHE_MAX_AGE', 0)
+
+
+# Page through survey report submissions by seeking to (submitted_at, id)
+# rather than with an OFFSET, so that deep pages are as fast as the first.
+# Previous and Next links carry an opaque cursor. Ignored when PRE_REPORT is
+# set, since that may sort submissions some other way.
+KEYSET_PAGINATION = getattr(_gs, 'CROWDSOURCING_KEYSET_PAGINATION', False)
+
+
+# Use the form 'path.to.my_function' for a function that returns the client
+# crowdsourcing uses to talk to Flickr, in place of flickrapi.FlickrAPI. This
+# is mostly for tests.
+FLICKR_CLIENT = getattr(_gs, 'CROWDSOURCING_FLICKR_CLIENT', '')
+
+# When SYNCHRONOUS_FLICKR_UPLOAD is False, photos wait in the FlickrUpload
+# table. Each run of FlickrUpload.process_queue uploads at most this many of
+# them, this many at a time.
+FLICKR_UPLOAD_BATCH_SIZE = getattr(_gs,
+                                   'CROWDSOURCING_FLICKR_UPLOAD_BATCH_SIZE',
+                                   20)
+FLICKR_UPLOAD_WORKERS = getattr(_gs, 'CROWDSOURCING_FLICKR_UPLOAD_WORKERS', 4)
+
+# A failed upload waits this many seconds before the next try, twice as long
+# after each failure, up to FLICKR_UPLOAD_MAX_ATTEMPTS tries in all.
+FLICKR_UPLOAD_RETRY_DELAY = getattr(_gs,
+                                    'CROWDSOURCING_FLICKR_UPLOAD_RETRY_DELAY',
+                                    60)
+FLICKR_UPLOAD_MAX_ATTEMPTS = getattr(
+    _gs,
+    'CROWDSOURCING_FLICKR_UPLOAD_MAX_ATTEMPTS',
+    6)
+
+
+# Make every size of thumbnail for photo answers while the submission goes
+# through, rather than when a report first shows them. Set this to False to
+# make them in the background instead, with regular calls to
+# crowdsourcing.models.Answer.make_pending_thumbnails. crowdsourcing/tasks.py
+# sets up a celery task for that.
+SYNCHRONOUS_THUMBNAILS = getattr(_gs,
+                                 'CROWDSOURCING_SYNCHRONOUS_THUMBNAILS',
+                                 True)
+
+# How many photos Answer.make_thumbnails resizes at once.
+THUMBNAIL_WORKERS = getattr(_gs, 'CROWDSOURCING_THUMBNAIL_WORKERS', 4)
+
+# simple_slideshow shows this many slides at first and loads the rest from
+# the slideshow_slides view as people page through them. 0 shows every slide
+# at once.
+SLIDESHOW_PAGE_SIZE = getattr(_gs, 'CROWDSOURCING_SLIDESHOW_PAGE_SIZE', 0)
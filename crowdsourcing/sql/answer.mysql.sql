@@ -0,0 +1,2 @@
+-- MySQL can only index the start of a text column.
+CREATE INDEX crowdsourcing_answer_question_text ON crowdsourcing_answer (question_id, text_answer(255), submission_id);
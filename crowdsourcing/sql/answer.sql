@@ -0,0 +1,7 @@
+-- Composite indexes for the report and filter queries, which always narrow
+-- crowdsourcing_answer down by question first. Django runs this after syncdb
+-- creates the table. For an existing table use ./manage.py report_indexes create
+CREATE INDEX crowdsourcing_answer_question_submission ON crowdsourcing_answer (question_id, submission_id);
+CREATE INDEX crowdsourcing_answer_question_integer ON crowdsourcing_answer (question_id, integer_answer, submission_id);
+CREATE INDEX crowdsourcing_answer_question_float ON crowdsourcing_answer (question_id, float_answer, submission_id);
+CREATE INDEX crowdsourcing_answer_question_boolean ON crowdsourcing_answer (question_id, boolean_answer, submission_id);
@@ -0,0 +1 @@
+CREATE INDEX crowdsourcing_answer_question_text ON crowdsourcing_answer (question_id, text_answer, submission_id);
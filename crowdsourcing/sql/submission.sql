@@ -0,0 +1,5 @@
+-- Reports list a survey's public, and maybe featured, submissions newest
+-- first. Staff see them all. The trailing id makes keyset pagination a
+-- straight index range scan.
+CREATE INDEX crowdsourcing_submission_survey_public ON crowdsourcing_submission (survey_id, is_public, featured, submitted_at, id);
+CREATE INDEX crowdsourcing_submission_survey_submitted ON crowdsourcing_submission (survey_id, submitted_at, id);
@@ -9,6 +9,7 @@ from datetime import timedelta
 import logging
 from .models import Answer
 from . import settings as local_settings
+from . import wide
 
 logger = logging.getLogger('crowdsourcing.tasks')
 
@@ -21,3 +22,38 @@ class SyncFlickr(PeriodicTask):
 
 if tasks and not local_settings.SYNCHRONOUS_FLICKR_UPLOAD:
     tasks.register(SyncFlickr)
+
+
+class GeocodeLocations(PeriodicTask):
+    run_every = timedelta(minutes=1)
+
+    def run(self, *args, **kwargs):
+        logger.debug("Geocoding pending locations")
+        while Answer.geocode_pending_answers():
+            pass
+
+if tasks and not local_settings.SYNCHRONOUS_GEOCODING:
+    tasks.register(GeocodeLocations)
+
+
+class MakeThumbnails(PeriodicTask):
+    run_every = timedelta(minutes=1)
+
+    def run(self, *args, **kwargs):
+        logger.debug("Making pending thumbnails")
+        while Answer.make_pending_thumbnails():
+            pass
+
+if tasks and not local_settings.SYNCHRONOUS_THUMBNAILS:
+    tasks.register(MakeThumbnails)
+
+
+class BuildWideTables(PeriodicTask):
+    run_every = timedelta(minutes=5)
+
+    def run(self, *args, **kwargs):
+        logger.debug("Building missing wide tables")
+        wide.build_missing()
+
+if tasks:
+    tasks.register(BuildWideTables)
@@ -6,7 +6,6 @@ import re
 from django import template
 from django.contrib.sites.models import Site
 from django.core.cache import cache
-from django.core.files.images import get_image_dimensions
 from django.core.urlresolvers import reverse
 from django.template import Node
 from django.utils.safestring import mark_safe
@@ -588,46 +587,82 @@ def popup_google_map(display, question, report):
 register.simple_tag(popup_google_map)
 
 
-def simple_slideshow(display, question, request_GET, css):
+def simple_slideshow(display,
+                     question,
+                     request_GET,
+                     css,
+                     is_staff=False,
+                     page_size=None):
+    """ Set page_size, or CROWDSOURCING_SLIDESHOW_PAGE_SIZE, to show that
+    many slides at first and load the rest as people page through them. """
     id = "slideshow_%d_%d" % (display.order, question.id)
+    if page_size is None:
+        page_size = local_settings.SLIDESHOW_PAGE_SIZE
+    if not display.pk:
+        # Default reports aren't saved, so slideshow_slides can't find the
+        # display. Show every slide.
+        page_size = 0
+    answers = display.slide_answers(question, request_GET, is_staff)
+    options = ""
+    if page_size:
+        url = reverse("slideshow_slides", kwargs={
+            "slug": display.get_report().survey.slug,
+            "display_id": display.id,
+            "question_id": question.id})
+        if request_GET:
+            url += "?" + request_GET.urlencode()
+        options = "{size: %d, itemLoadCallback: %s}" % (
+            answers.count(),
+            "crowdsourcingLoadSlides(%s)" % json.dumps(url))
+        answers = answers[:page_size]
+    answers = list(answers)
+    captions = display.slide_captions(answers)
     out = [
         '<h2 class="chart_title">%s</h2>' % display.annotation,
         '<ul class="%s" id="%s">' % (css, id),
-        '<script type="text/javascript">',
+        '<script type="text/javascript">']
+    if page_size:
+        out.extend([
+            'function crowdsourcingLoadSlides(url) {',
+            '  return function(carousel, state) {',
+            '    if (carousel.has(carousel.first, carousel.last)) {',
+            '      return;',
+            '    }',
+            '    $.getJSON(url, {start: carousel.first - 1,',
+            '                    count: carousel.last - carousel.first + 1},',
+            '      function(data) {',
+            '        $.each(data.slides, function(i, slide) {',
+            '          carousel.add(data.start + i + 1, slide);',
+            '        });',
+            '      });',
+            '  };',
+            '}'])
+    out.extend([
         '$(function() {',
-        "  $('#%s').jcarousel();" % id,
+        "  $('#%s').jcarousel(%s);" % (id, options),
         '});',
-        '</script>']
-    caption_fieldnames = display.get_caption_fieldnames()
-    caption_lookup = {}
-    if caption_fieldnames:
-        captions = Answer.objects.filter(
-            question__fieldname__in=caption_fieldnames,
-            question__survey=display.report.survey,
-            submission__is_public=True)
-        for caption in captions:
-            if not caption.submission_id in caption_lookup:
-                caption_lookup[caption.submission_id] = []
-            append = "<div class='caption'>%s</div>" % str(caption.value)
-            caption_lookup[caption.submission_id].append(append)
-    answers = extra_from_filters(
-        question.answer_set.all(),
-        "submission_id",
-        display.report.survey,
-        request_GET)
+        '</script>'])
     for answer in answers:
+        out.extend(['<li>', slide(answer, captions), '</li>'])
+    out.append("</ul>")
+    return mark_safe("\n".join(out))
+register.simple_tag(simple_slideshow)
+
+
+def slide(answer, captions):
+    """ A slideshow item for a photo answer. captions comes from
+    SurveyReportDisplay.slide_captions. """
+    thumbnail = answer.get_thumbnail()
+    if thumbnail:
+        image = _img_tag(thumbnail)
+    else:
         try:
             image = answer.image_answer.thumbnail_tag
         except ThumbnailException:
             image = "Can't find %s" % answer.image_answer.url
-        out.extend([
-            '<li>',
-            image,
-            "\n".join(caption_lookup.get(answer.submission_id, [])),
-            '</li>'])
-    out.append("</ul>")
-    return mark_safe("\n".join(out))
-register.simple_tag(simple_slideshow)
+    caption_tags = ["<div class='caption'>%s</div>" % str(caption.value)
+                    for caption in captions.get(answer.submission_id, [])]
+    return "\n".join([image] + caption_tags)
 
 
 def load_maps_and_charts():
@@ -638,6 +673,16 @@ def load_maps_and_charts():
 register.simple_tag(load_maps_and_charts)
 
 
+def _img_tag(thumbnail, id=None):
+    """ thumbnail comes from Answer.get_thumbnail. """
+    id_attribute = ' id="%s"' % id if id else ""
+    return '<img src="%s" width="%d" height="%d"%s />' % (
+        thumbnail["url"],
+        thumbnail["width"],
+        thumbnail["height"],
+        id_attribute)
+
+
 def submission_fields(submission,
                       fields=None,
                       page_answers=None,
@@ -666,13 +711,24 @@ def submission_fields(submission,
         if answer and answer.value:
             out.append('<div class="field">')
             out.append('<label>%s</label>: ' % question.label)
-            if answer.image_answer:
+            if answer.get_thumbnail():
+                thumbnail = answer.get_thumbnail()
+                img_id = "img_%d" % answer.id
+                out.append(_img_tag(thumbnail, img_id))
+                enlarge = answer.get_thumbnail("max_enlarge")
+                width = enlarge and (answer.image_width or enlarge["width"])
+                # As below, only if it's at least 10% bigger.
+                if width and width > thumbnail["width"] * 1.1:
+                    format = ('<input type="hidden" id="img_%d_full_url" '
+                              'value="%s" class="enlargeable" />')
+                    out.append(format % (answer.id, enlarge["url"]))
+            elif answer.image_answer:
+                # From before Answer.make_thumbnails, or it failed.
                 valid = True
                 try:
                     thmb = answer.image_answer.thumbnail.absolute_url
                     args = (thmb, answer.id,)
                     out.append('<img src="%s" id="img_%d" />' % args)
-                    x_y = get_image_dimensions(answer.image_answer.file)
                 except ThumbnailException as ex:
                     valid = False
                     out.append('<div class="error">%s</div>' % str(ex))
@@ -680,7 +736,8 @@ def submission_fields(submission,
                 # This extra hidden input is in case you want to enlarge
                 # images. Don't bother enlarging images unless we'll increase
                 # their dimensions by at least 10%.
-                if valid and x_y and float(x_y[0]) / thumb_width > 1.1:
+                width = answer.image_width
+                if valid and width and float(width) / thumb_width > 1.1:
                     format = ('<input type="hidden" id="img_%d_full_url" '
                               'value="%s" class="enlargeable" />')
                     enlarge = answer.image_answer
@@ -765,11 +822,16 @@ def paginator(survey, report, pages_to_link, page_obj):
     if report.slug:
         view_name = "survey_report"
         url_args["report"] = report.slug
+    # Keyset pages hand out cursors so that Previous and Next can seek.
+    previous_cursor = getattr(page_obj, "previous_cursor", None)
+    next_cursor = getattr(page_obj, "next_cursor", None)
     if len(pages_to_link) > 1:
         out.append('<div class="pages">')
         if page_obj.has_previous():
             url_args["page"] = page_obj.previous_page_number()
             url = reverse(view_name, kwargs=url_args)
+            if previous_cursor and url_args["page"] > 1:
+                url += "?before=" + previous_cursor
             out.append('<a href="%s">&laquo; Previous</a>' % url)
         for page in pages_to_link:
             if not page:
@@ -783,6 +845,8 @@ def paginator(survey, report, pages_to_link, page_obj):
         if page_obj.has_next():
             url_args["page"] = page_obj.next_page_number()
             url = reverse(view_name, kwargs=url_args)
+            if next_cursor:
+                url += "?after=" + next_cursor
             out.append('<a href="%s">Next &raquo;</a>' % url)
         out.append("</div>")
     return mark_safe("\n".join(out))
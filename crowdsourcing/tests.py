@@ -3,11 +3,41 @@ run these tests with nose.
 """
 
 from __future__ import absolute_import
+from datetime import datetime, timedelta
+import json
 import unittest
+from xml.etree import ElementTree
 
-from .models import Survey, Question, Answer, Submission
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.http import Http404, HttpResponse, QueryDict
+from django.test.client import RequestFactory
+from django.utils.cache import has_vary_header
+
+from .flickrsupport import set_flickr
+from . import models
+from .models import (Survey, Question, Answer, AnswerTally, CompiledFilters,
+                     AggregateResult2AxisCount, AggregateResultSum,
+                     FlickrUpload, GeocodedLocation, ReportContext, Submission,
+                     SurveyReport, SURVEY_DISPLAY_TYPE_CHOICES,
+                     process_new_answers)
+from . import settings as local_settings
+from .geo import (bounding_box, geocode_cache_stats,
+                  get_latitude_and_longitude, set_geocoder)
+from .templatetags.crowdsourcing import (simple_slideshow, slide,
+                                         submission_fields)
+from .views import (CountedPaginator, _add_cors_headers, _default_report,
+                    _export_keys, _report_cache_key, allow_origin_sites,
+                    decode_cursor, encode_cursor, keyset_paginate_or_404,
+                    origin_of, slideshow_slides, submissions)
+from . import wide
+
+class SurveyFixture(object):
+    """ The survey every test case works with. Test cases that need it but
+    none of SurveyTestCase's tests mix this in, rather than subclassing
+    SurveyTestCase and running its tests all over again. """
 
-class SurveyTestCase(unittest.TestCase):
     def setUp(self):
         self.survey=Survey.objects.create(
             title="Test Survey",
@@ -31,7 +61,20 @@ class SurveyTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.survey.delete()
-        
+
+
+class SubmissionFixture(SurveyFixture):
+    """ SurveyFixture with a submission. """
+
+    def setUp(self):
+        super(SubmissionFixture, self).setUp()
+        self.submission=self.survey.submission_set.create(
+            ip_address='127.0.0.1',
+            session_key='X' * 40)
+
+
+class SurveyTestCase(SurveyFixture, unittest.TestCase):
+
     def testLive1(self):
         self.assertEquals(self.survey,
                           Survey.live.get(slug=self.survey.slug))
@@ -42,15 +85,35 @@ class SurveyTestCase(unittest.TestCase):
         def getit():
             return Survey.live.get(slug=self.survey.slug)
         self.assertRaises(Survey.DoesNotExist, getit)
-            
 
-class SubmissionTestCase(SurveyTestCase):
+    def testSchema(self):
+        old_setting = local_settings.CACHE_SURVEY_SCHEMA
+        local_settings.CACHE_SURVEY_SCHEMA = True
+        try:
+            schema = self.survey.get_schema()
+            self.assertEquals(schema.fieldnames, ('color', 'video', 'email'))
+            survey = Survey.objects.get(pk=self.survey.pk)
+            self.assert_(schema is survey.get_schema())
+            question = self.survey.questions.get(fieldname='color')
+            question.label = 'Color'
+            question.save()
+            fields = Survey.objects.get(pk=self.survey.pk).get_fields()
+            self.assertEquals(fields[0].label, 'Color')
+            cached = self.survey.get_schema().questions[0]
+            self.assert_(fields[0] is not cached)
+            self.assert_(fields[0]._state is not cached._state)
+        finally:
+            local_settings.CACHE_SURVEY_SCHEMA = old_setting
 
-    def setUp(self):
-        super(SubmissionTestCase, self).setUp()
-        self.submission=self.survey.submission_set.create(
-            ip_address='127.0.0.1',
-            session_key='X' * 40)
+    def testReportContextOncePerRequest(self):
+        query = QueryDict("color=red")
+        context = ReportContext.get(self.survey, query)
+        self.assert_(context is ReportContext.get(self.survey, query))
+        self.assert_(context is not ReportContext.get(self.survey,
+                                                     QueryDict("color=red")))
+            
+
+class SubmissionTestCase(SubmissionFixture, SurveyTestCase):
 
     def testAnswer1(self):
         answer=self.submission.answer_set.create(
@@ -79,4 +142,774 @@ class SubmissionTestCase(SurveyTestCase):
         answer.save()
         self.assertEquals(answer.text_answer, e)
         self.assertEquals(self.submission.email, e)        
+
+    def testPlannedCounts(self):
+        question = self.survey.questions.get(fieldname='color')
+        answer = Answer(submission=self.submission, question=question)
+        answer.value = 'red'
+        answer.save()
+        report = SurveyReport.objects.create(survey=self.survey,
+                                             title="Colors",
+                                             slug="colors")
+        report.surveyreportdisplay_set.create(
+            display_type=SURVEY_DISPLAY_TYPE_CHOICES.PIE,
+            fieldnames="color")
+        context = ReportContext(self.survey, QueryDict(""))
+        context.plan(report)
+        self.assertEquals(context.planned_counts(question, False, False),
+                          [{"text_answer": "red", "count": 1}])
+        video = self.survey.questions.get(fieldname='video')
+        self.assertEquals(context.planned_counts(video, False, False), None)
+
+    def testSinglePassSkipsMissingYValues(self):
+        questions = [self.survey.questions.create(fieldname=fieldname,
+                                                  question=fieldname,
+                                                  order=order,
+                                                  option_type='integer')
+                     for order, fieldname in enumerate(
+                         ('size', 'weight', 'height'), 4)]
+        size, weight, height = questions
+        other = self.survey.submission_set.create(ip_address='127.0.0.1',
+                                                  session_key='Y' * 40)
+        # Nobody gave a height, and the second submission no weight either.
+        for submission, values in ((self.submission, (1, 5, "")),
+                                   (other, (2, "", ""))):
+            for question, value in zip(questions, values):
+                answer = Answer(submission=submission, question=question)
+                answer.value = value
+                answer.save()
+        old_settings = (local_settings.SINGLE_PASS_AGGREGATES,
+                        local_settings.REPORT_CACHE_TIMEOUT)
+        local_settings.REPORT_CACHE_TIMEOUT = 0
+        try:
+            for aggregate in (AggregateResultSum, AggregateResult2AxisCount):
+                results = []
+                for single_pass in (True, False):
+                    local_settings.SINGLE_PASS_AGGREGATES = single_pass
+                    result = aggregate([weight, height],
+                                       size,
+                                       QueryDict(""))
+                    results.append(result.answer_values)
+                self.assertEquals(results[0], results[1])
+                self.assertEquals([v["size"] for v in results[0]], [1])
+            result = AggregateResultSum([height], size, QueryDict(""))
+            self.assertEquals(result.answer_values, [])
+        finally:
+            (local_settings.SINGLE_PASS_AGGREGATES,
+             local_settings.REPORT_CACHE_TIMEOUT) = old_settings
+
+    def testSlideCaptions(self):
+        question = self.survey.questions.get(fieldname='color')
+        other = self.survey.submission_set.create(ip_address='127.0.0.1',
+                                                  session_key='Y' * 40)
+        for submission, color in ((self.submission, 'red'), (other, 'blue')):
+            submission.is_public = True
+            submission.save()
+            answer = Answer(submission=submission, question=question)
+            answer.value = color
+            answer.save()
+        report = SurveyReport.objects.create(survey=self.survey,
+                                             title="Photos",
+                                             slug="photos")
+        display = report.surveyreportdisplay_set.create(
+            display_type=SURVEY_DISPLAY_TYPE_CHOICES.SLIDESHOW,
+            caption_fields="color")
+        shown = [Answer(submission=self.submission)]
+        captions = display.slide_captions(shown)
+        self.assertEquals(captions.keys(), [self.submission.id])
+        self.assertEquals(captions[self.submission.id][0].value, 'red')
+        self.assertEquals(display.slide_captions([]), {})
+
+    def testSubmissionCounts(self):
+        def counts():
+            survey = Survey.objects.get(pk=self.survey.pk)
+            return survey.submission_count, survey.public_submission_count
+        public = 1 if self.submission.is_public else 0
+        self.assertEquals(counts(), (1, public))
+        self.submission.is_public = not self.submission.is_public
+        self.submission.save()
+        self.assertEquals(counts(), (1, 1 - public))
+        self.submission.delete()
+        self.assertEquals(counts(), (0, 0))
+
+    def testBulkDeleteFindsLastSubmission(self):
+        first = self.submission.submitted_at
+        for minutes in (1, 2):
+            self.survey.submission_set.create(
+                ip_address='127.0.0.1',
+                session_key='X' * 40,
+                submitted_at=first + timedelta(minutes=minutes))
+        self.survey.submission_set.filter(submitted_at__gt=first).delete()
+        survey = Survey.objects.get(pk=self.survey.pk)
+        self.assertEquals(survey.submission_count, 1)
+        self.assertEquals(survey.last_submitted_at.replace(microsecond=0),
+                          first.replace(microsecond=0))
         
+
+
+class AnswerTallyTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(AnswerTallyTestCase, self).setUp()
+        self.old_setting = local_settings.USE_ANSWER_TALLIES
+        local_settings.USE_ANSWER_TALLIES = True
+        self.question = self.survey.questions.get(fieldname='color')
+
+    def tearDown(self):
+        local_settings.USE_ANSWER_TALLIES = self.old_setting
+        super(AnswerTallyTestCase, self).tearDown()
+
+    def tally(self, value, is_public=True):
+        tallies = AnswerTally.objects.filter(question=self.question,
+                                             value=value,
+                                             is_public=is_public)
+        return sum(t.count for t in tallies)
+
+    def testTallyFollowsAnswers(self):
+        answer = Answer(submission=self.submission, question=self.question)
+        answer.value = 'red'
+        answer.save()
+        self.assertEquals(self.tally('red'), 1)
+        answer.value = 'blue'
+        answer.save()
+        self.assertEquals(self.tally('red'), 0)
+        self.assertEquals(self.tally('blue'), 1)
+        answer.delete()
+        self.assertEquals(self.tally('blue'), 0)
+
+    def testTallyFollowsModeration(self):
+        answer = Answer(submission=self.submission, question=self.question)
+        answer.value = 'red'
+        answer.save()
+        self.submission.is_public = False
+        self.submission.save()
+        self.assertEquals(self.tally('red'), 0)
+        self.assertEquals(self.tally('red', is_public=False), 1)
+
+
+class WideTableTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(WideTableTestCase, self).setUp()
+        self.survey.use_wide_table = True
+        self.survey.save()
+        self.assert_(not wide.is_enabled(self.survey.id))
+        self.assertEquals(wide.build_missing(), 1)
+        self.assert_(wide.is_enabled(self.survey.id))
+        self.question = self.survey.questions.get(fieldname='color')
+
+    def answers(self):
+        lookup = wide.get_all_answers(self.survey.id,
+                                      [self.submission],
+                                      [self.question])
+        return [a.value for a in lookup.get(self.submission.id, [])]
+
+    def testRowFollowsAnswers(self):
+        answer = Answer(submission=self.submission, question=self.question)
+        answer.value = 'red'
+        answer.save()
+        self.assertEquals(self.answers(), ['red'])
+        answer.delete()
+        self.assertEquals(self.answers(), [])
+
+    def testSurveySaves(self):
+        self.survey.title = "Renamed"
+        self.survey.save()
+        self.assert_(wide.is_enabled(self.survey.id))
+        self.assert_(not wide.rebuild(self.survey.id))
+        self.assert_(self.survey.id in wide.wide_survey_ids())
+        self.survey.use_wide_table = False
+        self.survey.save()
+        self.assert_(self.survey.id not in wide.wide_survey_ids())
+        self.assert_(not wide.is_enabled(self.survey.id))
+        tables = connection.introspection.table_names()
+        self.assert_(wide.table_name(self.survey.id) not in tables)
+
+    def testNewQuestionWaitsForRebuild(self):
+        self.survey.questions.create(fieldname="size",
+                                     question="How big?",
+                                     order=4,
+                                     option_type="integer")
+        self.assert_(not wide.is_enabled(self.survey.id))
+        self.assertEquals(wide.build_missing(), 1)
+        self.assert_(wide.is_enabled(self.survey.id))
+
+    def testFilterSubquery(self):
+        sql, params = wide.filter_subquery(
+            self.survey.id,
+            [("{a}.text_answer = %s", [self.question.id, "red"])])
+        self.assert_("w.q%d_text_answer = %%s" % self.question.id in sql)
+        self.assertEquals(params, ["red"])
+
+
+class GeocodePendingTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(GeocodePendingTestCase, self).setUp()
+        self.geocoded = []
+        def geocode(location):
+            self.geocoded.append(location)
+            return 40.7, -74.0
+        set_geocoder(geocode)
+        self.question = self.survey.questions.create(
+            fieldname='where',
+            question='Where are you?',
+            order=4,
+            option_type='location')
+
+    def tearDown(self):
+        set_geocoder(None)
+        GeocodedLocation.objects.all().delete()
+        super(GeocodePendingTestCase, self).tearDown()
+
+    def testPendingAnswersGetGeocodedOnce(self):
+        for i in range(2):
+            answer = Answer(submission=self.submission,
+                            question=self.question,
+                            geocode_pending=True)
+            answer.value = 'Brooklyn, NY'
+            answer.save()
+        self.assertEquals(Answer.geocode_pending_answers(), 2)
+        self.assertEquals(self.geocoded, ['Brooklyn, NY'])
+        answers = Answer.objects.filter(question=self.question)
+        self.assertEquals([(a.latitude, a.geocode_pending) for a in answers],
+                          [(40.7, False), (40.7, False)])
+
+    def testGeocodeCache(self):
+        Answer.objects.create(submission=self.submission,
+                              question=self.question,
+                              text_answer='Brooklyn, NY',
+                              geocode_pending=True)
+        Answer.geocode_pending_answers()
+        set_geocoder(lambda location: (0.0, 0.0))
+        self.assertEquals(get_latitude_and_longitude(' brooklyn,  ny'),
+                          (40.7, -74.0))
+        self.assertEquals(get_latitude_and_longitude('Brooklyn, NY'),
+                          (40.7, -74.0))
+        stats = geocode_cache_stats()
+        self.assertEquals((stats["database_hits"], stats["memory_hits"]),
+                          (1, 1))
+
+
+# A 1x1 pixel.
+GIF = ('GIF89a\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff\x00\x00'
+       '\x00!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01'
+       '\x00\x01\x00\x00\x02\x02D\x01\x00;')
+
+
+class FakeFlickr(object):
+    def upload(self, **kwargs):
+        raise IOError("Flickr is down")
+
+
+class RecordingFlickr(object):
+    """ Remembers what it was asked to do. Every upload becomes photo 99. """
+    def __init__(self):
+        self.calls = []
+
+    def _photo(self, call):
+        self.calls.append(call)
+        return ElementTree.fromstring("<rsp><photoid>99</photoid></rsp>")
+
+    def upload(self, **kwargs):
+        return self._photo("upload")
+
+    def replace(self, **kwargs):
+        return self._photo("replace")
+
+    def groups_pools_add(self, **kwargs):
+        self.calls.append("groups_pools_add")
+
+    def photos_delete(self, **kwargs):
+        self.calls.append("photos_delete")
+
+
+class FlickrUploadTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(FlickrUploadTestCase, self).setUp()
+        self.old_setting = local_settings.SYNCHRONOUS_FLICKR_UPLOAD
+        local_settings.SYNCHRONOUS_FLICKR_UPLOAD = False
+        set_flickr(FakeFlickr())
+        Survey.objects.filter(pk=self.survey.pk).update(flickr_group_id="1")
+        self.question = self.survey.questions.create(
+            fieldname='photo',
+            question='Show us',
+            order=4,
+            option_type='photo')
+
+    def tearDown(self):
+        set_flickr(None)
+        local_settings.SYNCHRONOUS_FLICKR_UPLOAD = self.old_setting
+        super(FlickrUploadTestCase, self).tearDown()
+
+    def testFailuresAreRecorded(self):
+        answer = Answer(submission=self.submission, question=self.question)
+        answer.value = 'photos/missing.jpg'
+        answer.save()
+        self.assertEquals(FlickrUpload.process_queue(), 1)
+        upload = FlickrUpload.objects.get(answer=answer)
+        self.assertEquals(upload.attempts, 1)
+        self.assert_(upload.last_error)
+        self.assertEquals(FlickrUpload.process_queue(), 0)
+
+    def testRequeuedWhileUploading(self):
+        answer = Answer(submission=self.submission, question=self.question)
+        answer.value = 'photos/first.jpg'
+        answer.save()
+        self.assertEquals(FlickrUpload.process_queue(), 1)
+        uploads = FlickrUpload.objects.select_related("answer")
+        claimed = uploads.get(answer=answer)
+        # A new photo comes in while the old one is on its way to Flickr.
+        answer = Answer.objects.get(pk=answer.pk)
+        answer.value = 'photos/second.jpg'
+        answer.save()
+        claimed.answer.flickr_id = '42'
+        claimed.succeeded()
+        claimed.failed("Flickr is down")
+        requeued = FlickrUpload.objects.get(answer=answer)
+        self.assertEquals(requeued.attempts, 0)
+        self.assertEquals(requeued.last_error, "")
+        self.assertEquals(Answer.objects.get(pk=answer.pk).flickr_id, '')
+
+    def testNewUploadOfASharedPhoto(self):
+        flickr = RecordingFlickr()
+        set_flickr(flickr)
+        first = Answer.objects.create(submission=self.submission,
+                                      question=self.question,
+                                      image_answer='photos/first.jpg',
+                                      photo_hash='a' * 40,
+                                      flickr_id='42')
+        second = Answer.objects.create(submission=self.submission,
+                                       question=self.question,
+                                       image_answer='photos/second.jpg',
+                                       photo_hash='a' * 40,
+                                       flickr_id='42')
+        self.assertEquals(FlickrUpload.objects.count(), 0)
+        # As PhotoUpload.save does it.
+        second.image_answer = SimpleUploadedFile("third.gif", GIF)
+        second.photo_hash = 'b' * 40
+        second.save()
+        self.assertEquals(Answer.objects.get(pk=second.pk).photo_hash,
+                          'b' * 40)
+        self.assertEquals(FlickrUpload.process_queue(), 1)
+        self.assertEquals(flickr.calls, ["upload", "groups_pools_add"])
+        self.assertEquals(Answer.objects.get(pk=second.pk).flickr_id, '99')
+        self.assertEquals(Answer.objects.get(pk=first.pk).flickr_id, '42')
+        self.assertEquals(FlickrUpload.objects.count(), 0)
+
+    def testIdenticalPhotosShareAFlickrPhoto(self):
+        Answer.objects.create(submission=self.submission,
+                              question=self.question,
+                              image_answer='photos/first.jpg',
+                              photo_hash='a' * 40,
+                              flickr_id='42')
+        self.assertEquals(FlickrUpload.objects.count(), 0)
+        answer = Answer.objects.create(submission=self.submission,
+                                       question=self.question,
+                                       image_answer='photos/second.jpg',
+                                       photo_hash='a' * 40)
+        self.assertEquals(FlickrUpload.process_queue(), 1)
+        self.assertEquals(Answer.objects.get(pk=answer.pk).flickr_id, '42')
+        self.assertEquals(FlickrUpload.objects.count(), 0)
+
+
+class ThumbnailTestCase(unittest.TestCase):
+
+    def testRecordedThumbnails(self):
+        answer = Answer(thumbnails='{"default": {"url": "/t.jpg", '
+                                   '"width": 250, "height": 200}}')
+        self.assertEquals(answer.get_thumbnail()["width"], 250)
+        self.assertEquals(answer.get_thumbnail("max_enlarge"), None)
+        self.assertEquals(Answer().get_thumbnail(), None)
+
+    def testImageDimensions(self):
+        answer = Answer()
+        answer.set_image_dimensions(SimpleUploadedFile("dot.gif", GIF))
+        self.assertEquals((answer.image_width, answer.image_height), (1, 1))
+        answer.set_image_dimensions(SimpleUploadedFile("dot.gif", "nope"))
+        self.assertEquals(answer.image_width, None)
+
+
+def fake_thumbnails(image):
+    """ Stands in for models._make_thumbnails, which needs sorl and real
+    photos. Photos with "broken" in the name fail. """
+    if "broken" in image.name:
+        return None
+    return {"default": {"url": "/t/%s" % image.name,
+                        "width": 250,
+                        "height": 200},
+            "max_enlarge": {"url": "/big/%s" % image.name,
+                            "width": 1000,
+                            "height": 800}}
+
+
+class MakeThumbnailsTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(MakeThumbnailsTestCase, self).setUp()
+        self.old_setting = local_settings.SYNCHRONOUS_THUMBNAILS
+        local_settings.SYNCHRONOUS_THUMBNAILS = False
+        self.old_make_thumbnails = models._make_thumbnails
+        models._make_thumbnails = fake_thumbnails
+        self.question = self.survey.questions.create(
+            fieldname='photo',
+            question='Show us',
+            order=4,
+            option_type='photo')
+
+    def tearDown(self):
+        models._make_thumbnails = self.old_make_thumbnails
+        local_settings.SYNCHRONOUS_THUMBNAILS = self.old_setting
+        super(MakeThumbnailsTestCase, self).tearDown()
+
+    def photo(self, name, **kwargs):
+        answer = Answer(submission=self.submission,
+                        question=self.question,
+                        **kwargs)
+        answer.value = name
+        answer.save()
+        return answer
+
+    def testMakeThumbnails(self):
+        good = self.photo('photos/good.jpg')
+        broken = self.photo('photos/broken.jpg')
+        pending = Answer.objects.filter(thumbnails_pending=True)
+        self.assertEquals(pending.count(), 2)
+        self.assertEquals(Answer.make_thumbnails([good, broken]), 1)
+        self.assertEquals(good.get_thumbnail()["url"], "/t/photos/good.jpg")
+        saved = Answer.objects.get(pk=good.pk)
+        self.assertEquals(saved.get_thumbnail("max_enlarge")["width"], 1000)
+        self.assertEquals(Answer.objects.get(pk=broken.pk).thumbnails, "")
+        self.assertEquals(pending.count(), 0)
+
+    def testMakePendingThumbnails(self):
+        for name in ('photos/first.jpg', 'photos/second.jpg'):
+            self.photo(name)
+        self.assertEquals(Answer.make_pending_thumbnails(batch_size=1), 1)
+        self.assertEquals(Answer.make_pending_thumbnails(batch_size=1), 1)
+        self.assertEquals(Answer.make_pending_thumbnails(batch_size=1), 0)
+        answers = Answer.objects.filter(question=self.question)
+        self.assert_(all(a.get_thumbnail() for a in answers))
+
+    def testSaveMarksPhotosPending(self):
+        local_settings.SYNCHRONOUS_THUMBNAILS = True
+        answer = self.photo('photos/first.jpg')
+        saved = Answer.objects.get(pk=answer.pk)
+        self.assertEquals(saved.thumbnails_pending, False)
+        self.assertEquals(saved.get_thumbnail()["url"],
+                          "/t/photos/first.jpg")
+        local_settings.SYNCHRONOUS_THUMBNAILS = False
+        saved.save()
+        self.assertEquals(saved.thumbnails_pending, False)
+        saved.value = 'photos/second.jpg'
+        saved.save()
+        saved = Answer.objects.get(pk=answer.pk)
+        self.assertEquals((saved.thumbnails, saved.thumbnails_pending),
+                          ("", True))
+        color = self.survey.questions.get(fieldname='color')
+        answer = Answer(submission=self.submission, question=color)
+        answer.value = 'red'
+        answer.save()
+        self.assertEquals(answer.thumbnails_pending, False)
+
+    def testProcessNewAnswers(self):
+        color = self.survey.questions.get(fieldname='color')
+        answers = [Answer(submission=self.submission,
+                          question=self.question,
+                          image_answer='photos/new.jpg'),
+                   Answer(submission=self.submission,
+                          question=color,
+                          text_answer='red')]
+        Answer.objects.bulk_create(answers)
+        process_new_answers(self.submission, answers)
+        pending = Answer.objects.filter(thumbnails_pending=True)
+        self.assertEquals([a.question_id for a in pending],
+                          [self.question.id])
+        local_settings.SYNCHRONOUS_THUMBNAILS = True
+        process_new_answers(self.submission, answers)
+        self.assertEquals(pending.count(), 0)
+        photo = Answer.objects.get(question=self.question)
+        self.assertEquals(photo.get_thumbnail()["url"], "/t/photos/new.jpg")
+
+    def testRenderRecordedThumbnails(self):
+        answer = self.photo('photos/first.jpg', image_width=1200)
+        Answer.make_thumbnails([answer])
+        html = submission_fields(self.submission,
+                                 fields=[self.question],
+                                 page_answers={self.submission.id: [answer]})
+        self.assert_('<img src="/t/photos/first.jpg" width="250" '
+                     'height="200" id="img_%d" />' % answer.id in html)
+        self.assert_('value="/big/photos/first.jpg" class="enlargeable"'
+                     in html)
+        self.assertEquals(slide(answer, {}),
+                          '<img src="/t/photos/first.jpg" width="250" '
+                          'height="200" />')
+
+
+class SlideshowTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(SlideshowTestCase, self).setUp()
+        self.question = self.survey.questions.create(
+            fieldname='photo',
+            question='Show us',
+            order=4,
+            option_type='photo')
+        report = SurveyReport.objects.create(survey=self.survey,
+                                             title="Photos",
+                                             slug="photos")
+        self.display = report.surveyreportdisplay_set.create(
+            display_type=SURVEY_DISPLAY_TYPE_CHOICES.SLIDESHOW,
+            fieldnames="photo")
+        # Three public photos, then the newest, which isn't public.
+        start = datetime(2013, 5, 1, 12, 30)
+        submissions = [self.survey.submission_set.create(
+            ip_address='127.0.0.1',
+            session_key='X' * 40,
+            submitted_at=start + timedelta(minutes=i)) for i in range(3)]
+        self.submission.is_public = False
+        self.submission.save()
+        for i, submission in enumerate(submissions + [self.submission]):
+            Answer.objects.create(
+                submission=submission,
+                question=self.question,
+                image_answer='photos/%d.jpg' % i,
+                thumbnails='{"default": {"url": "/t/%d.jpg", '
+                           '"width": 250, "height": 200}}' % i)
+
+    def slides(self, query, user=None, question=None):
+        request = RequestFactory().get("/crowdsourcing/test-survey/api/"
+                                       "slideshow/?" + query)
+        if user:
+            request.user = user
+        question = question or self.question
+        response = slideshow_slides(request,
+                                    "test-survey",
+                                    self.display.id,
+                                    question.id)
+        data = json.loads(response.content)
+        urls = [slide.split('"')[1] for slide in data["slides"]]
+        return data["start"], urls
+
+    def testSlides(self):
+        self.assertEquals(self.slides("start=0&count=2"),
+                          (0, ["/t/2.jpg", "/t/1.jpg"]))
+        self.assertEquals(self.slides("start=2&count=5"), (2, ["/t/0.jpg"]))
+        self.assertEquals(self.slides("start=0&count=1", StaffUser()),
+                          (0, ["/t/3.jpg"]))
+
+    def testBadSlideRequests(self):
+        self.assertRaises(Http404, self.slides, "start=x")
+        color = self.survey.questions.get(fieldname='color')
+        self.assertRaises(Http404, self.slides, "", question=color)
+
+    def testFirstWindow(self):
+        html = simple_slideshow(self.display,
+                                self.question,
+                                QueryDict(""),
+                                "skin",
+                                page_size=2)
+        self.assert_("{size: 3, " in html)
+        self.assertEquals(html.count("<li>"), 2)
+        self.assert_(html.index("/t/2.jpg") < html.index("/t/1.jpg"))
+        self.assert_("/t/0.jpg" not in html)
+        self.assert_("/t/3.jpg" not in html)
+        html = simple_slideshow(self.display,
+                                self.question,
+                                QueryDict(""),
+                                "skin",
+                                is_staff=True,
+                                page_size=2)
+        self.assert_("{size: 4, " in html)
+        self.assert_("/t/3.jpg" in html)
+
+    def testWholeSlideshow(self):
+        html = simple_slideshow(self.display,
+                                self.question,
+                                QueryDict(""),
+                                "skin",
+                                page_size=0)
+        self.assertEquals(html.count("<li>"), 3)
+        self.assert_("crowdsourcingLoadSlides" not in html)
+
+    def testDefaultReport(self):
+        report = _default_report(self.survey, False)
+        display, = [d for d in report.survey_report_displays
+                    if d.is_slideshow]
+        html = simple_slideshow(display,
+                                self.question,
+                                QueryDict(""),
+                                "skin",
+                                page_size=2)
+        self.assertEquals(html.count("<li>"), 3)
+        self.assert_("crowdsourcingLoadSlides" not in html)
+
+
+class BoundingBoxTestCase(unittest.TestCase):
+
+    def testBox(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(40.7, -74.0, 10)
+        self.assertTrue(min_lat < 40.7 - 0.14 < 40.7 + 0.14 < max_lat)
+        self.assertTrue(min_lng < -74.0 - 0.19 < -74.0 + 0.19 < max_lng)
+
+    def testWrapsAround180(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(0.0, 179.9, 100)
+        self.assertTrue(min_lng > max_lng)
+
+    def testNearThePole(self):
+        box = bounding_box(89.9, 0.0, 100)
+        self.assertEquals((box[1], box[2], box[3]), (90.0, None, None))
+
+
+class CompiledFiltersTestCase(unittest.TestCase):
+
+    def testOneSubqueryForAllFilters(self):
+        compiled = CompiledFilters([("{a}.text_answer = %s", [1, "Red"]),
+                                    ("{a}.integer_answer <= %s", [2, 10])])
+        where, params = compiled.where("submission_id")
+        self.assertEquals(where.count("SELECT"), 1)
+        self.assert_("f1.integer_answer <= %s" in where)
+        self.assertEquals(params, [1, "Red", 2, 10])
+        self.failIf(CompiledFilters([]))
+
+
+class StaffUser(object):
+    id = 1
+    is_staff = True
+
+    def is_authenticated(self):
+        return True
+
+
+class ExportTestCase(SubmissionFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(ExportTestCase, self).setUp()
+        self.colors = self.survey.questions.create(
+            fieldname="colors",
+            question="Which colors?",
+            order=4,
+            option_type="bool_list",
+            options="<b>Red</b>\nBlue &amp; Green")
+        answer = Answer(submission=self.submission, question=self.colors)
+        answer.value = "Blue & Green"
+        answer.save()
+
+    def get(self, query):
+        request = RequestFactory().get("/crowdsourcing/submissions/csv/?" +
+                                       query)
+        request.user = StaffUser()
+        return request
+
+    def testExportKeys(self):
+        keys = _export_keys(self.survey, False)
+        self.assert_("Red" in keys)
+        self.assert_("Blue & Green" in keys)
+        self.assert_("colors" not in keys)
+
+    def testStream(self):
+        response = submissions(self.get("survey=test-survey&stream=true"),
+                               "csv")
+        lines = "".join(response).splitlines()
+        self.assertEquals(len(lines), 2)
+        header, row = [line.split(",") for line in lines]
+        self.assertEquals(dict(zip(header, row))["Blue & Green"], "1")
+        self.assertEquals(dict(zip(header, row))["Red"], "")
+
+    def testStreamUnknownSurvey(self):
+        request = self.get("survey=no-such-survey&stream=true")
+        self.assertRaises(Http404, submissions, request, "csv")
+
+
+class KeysetTestCase(SurveyFixture, unittest.TestCase):
+
+    def setUp(self):
+        super(KeysetTestCase, self).setUp()
+        start = datetime(2013, 5, 1, 12, 30, 15, 250)
+        self.submissions = [self.survey.submission_set.create(
+            ip_address='127.0.0.1',
+            session_key='X' * 40,
+            submitted_at=start + timedelta(minutes=i)) for i in range(5)]
+        self.submissions.reverse()
+
+    def testCursor(self):
+        submission = self.submissions[0]
+        cursor = encode_cursor(submission)
+        self.assert_("=" not in cursor)
+        self.assertEquals(decode_cursor(cursor),
+                          (submission.submitted_at, submission.id))
+        for garbage in ("", "nonsense", encode_cursor(submission)[:-3]):
+            self.assertEquals(decode_cursor(garbage), None)
+
+    def page(self, number, query=""):
+        paginator, page = keyset_paginate_or_404(
+            self.survey.submission_set.all(),
+            number,
+            QueryDict(query),
+            num_per_page=2)
+        return page
+
+    def testSeek(self):
+        first = self.page(1)
+        self.assertEquals(first.object_list, self.submissions[:2])
+        second = self.page(2, "after=" + first.next_cursor)
+        self.assertEquals(second.object_list, self.submissions[2:4])
+        self.assert_(second.has_next())
+        third = self.page(3, "after=" + second.next_cursor)
+        self.assertEquals(third.object_list, self.submissions[4:])
+        self.assert_(not third.has_next())
+        back = self.page(2, "before=" + third.previous_cursor)
+        self.assertEquals(back.object_list, self.submissions[2:4])
+        self.assertRaises(Http404, self.page, 2, "after=nonsense")
+
+    def testCacheKeySeesCursor(self):
+        def key(query):
+            request = RequestFactory().get("/crowdsourcing/test-survey/"
+                                           "report/2/?" + query)
+            return _report_cache_key(request,
+                                     self.survey,
+                                     "",
+                                     2,
+                                     ["survey_report.html"],
+                                     False)
+        cursor = encode_cursor(self.submissions[1])
+        self.assertNotEquals(key(""), key("after=" + cursor))
+        self.assertNotEquals(key("after=" + cursor), key("before=" + cursor))
+
+
+class CountedPaginatorTestCase(unittest.TestCase):
+
+    def testKnownCount(self):
+        self.assertEquals(CountedPaginator(range(5), 2, count=100).num_pages,
+                          50)
+        self.assertEquals(CountedPaginator(range(5), 2).num_pages, 3)
+
+
+class OriginTestCase(unittest.TestCase):
+
+    def testOrigin(self):
+        self.assertEquals(origin_of("HTTP://WWW.Example.com:8000/story/?a=1"),
+                          "http://www.example.com:8000")
+        self.assertEquals(origin_of("www.example.com"), "")
+
+    def testBareDomains(self):
+        old_sites = getattr(settings, "ADDITIONAL_CORS_SITES", [])
+        settings.ADDITIONAL_CORS_SITES = ["www.example.com",
+                                          "https://api.example.com"]
+        try:
+            sites = allow_origin_sites()
+        finally:
+            settings.ADDITIONAL_CORS_SITES = old_sites
+        for site in ("http://www.example.com",
+                     "https://www.example.com",
+                     "https://api.example.com"):
+            self.assert_(site in sites)
+        self.assert_("www.example.com" not in sites)
+
+    def testVary(self):
+        request = RequestFactory().get("/",
+                                       HTTP_ORIGIN="http://www.example.com")
+        response = _add_cors_headers(request, HttpResponse())
+        self.assert_(has_vary_header(response, "Origin"))
+        self.assert_(has_vary_header(response, "Referer"))
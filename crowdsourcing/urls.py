@@ -8,11 +8,13 @@ except:
                     
 
 from .views import (allowed_actions,
+                    bootstrap,
                     embeded_survey_questions,
                     embeded_survey_report,
                     location_question_results,
                     location_question_map,
                     questions,
+                    slideshow_slides,
                     submissions,
                     submission,
                     submission_for_map,
@@ -64,10 +66,19 @@ urlpatterns = patterns(
         questions,
         name="questions"),
 
+    url(r'^(?P<slug>[-a-z0-9_]+)/api/bootstrap/$',
+        bootstrap,
+        name="bootstrap"),
+
     url(r'^(?P<slug>[-a-z0-9_]+)/api/embeded_survey_questions/$',
         embeded_survey_questions,
         name="embeded_survey_questions"),
 
+    url(r'^(?P<slug>[-a-z0-9_]+)/api/slideshow/(?P<display_id>\d+)/'
+        r'(?P<question_id>\d+)/$',
+        slideshow_slides,
+        name="slideshow_slides"),
+
     url(r'^(?P<slug>[-a-z0-9_]+)/api/report/$',
         embeded_survey_report,
         {"report": ""},
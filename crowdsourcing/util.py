@@ -1,3 +1,4 @@
+import hashlib
 import itertools
 import re
 
@@ -16,6 +17,15 @@ def get_function(path):
     return got
 
 
+def get_photo_hash(djfile):
+    """ The SHA-1 of a Django File, which could be an upload still in memory
+    or a file in storage. """
+    h = hashlib.sha1()
+    for chunk in djfile.chunks():
+        h.update(chunk)
+    return h.hexdigest()
+
+
 class ChoiceEnum(object):
     def __init__(self, choices):
         if isinstance(choices, basestring):
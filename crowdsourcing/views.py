@@ -1,46 +1,71 @@
 from __future__ import absolute_import
 
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 import csv
 from datetime import datetime
+import hashlib
 import httplib
 from itertools import count
 import logging
 import smtplib
+import threading
+import time
+from urlparse import urlparse
 from xml.dom.minidom import Document
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import FieldError
 from django.core.mail import EmailMultiAlternatives
 from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.core.urlresolvers import reverse, NoReverseMatch
 from django.db.models import Q
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    # Django < 1.6
+    from django.db.transaction import commit_on_success as atomic
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         HttpResponseRedirect, Http404)
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5 streams plain responses built from iterators.
+    StreamingHttpResponse = HttpResponse
 from django.shortcuts import get_object_or_404, render_to_response
 from django.template import RequestContext as _rc
 from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.html import escape
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 
 from .forms import forms_for_survey
 from .models import (
+    AggregateResultCount,
     Answer,
     BALLOT_STUFFING_FIELDS,
     FORMAT_CHOICES,
     OPTION_TYPE_CHOICES,
     Question,
+    ReportContext,
     SURVEY_DISPLAY_TYPE_CHOICES,
     Submission,
     Survey,
     SurveyReport,
     SurveyReportDisplay,
     extra_from_filters,
+    filter_signature,
     get_all_answers,
-    get_filters)
+    process_new_answers)
+from .caching import (SITES_VERSION_KEY, get_survey_version,
+                      get_version, make_key)
 from .jsonutils import dump, dumps, datetime_to_string
 
 from .util import ChoiceEnum, get_function, get_session, get_user
 from . import settings as crowdsourcing_settings
+from . import wide
 
 
 def allow_origin_sites():
@@ -48,10 +73,51 @@ def allow_origin_sites():
     sites = Site.objects.all()
     for protocol in ["http", "https"]:
         database_sites += ["%s://%s" % (protocol, s.domain) for s in sites]
-    config_sites = getattr(settings, "ADDITIONAL_CORS_SITES", [])
+    config_sites = []
+    for site in getattr(settings, "ADDITIONAL_CORS_SITES", []):
+        if "://" in site:
+            config_sites.append(site)
+        else:
+            # A bare domain, as older versions took.
+            config_sites += ["%s://%s" % (protocol, site.strip("/"))
+                             for protocol in ["http", "https"]]
     return list(set(database_sites + config_sites))
 
 
+def origin_of(url):
+    """ The scheme://host[:port] part of url, lowercased, which is how we
+    compare origins. """
+    parsed = urlparse(url.strip())
+    if not parsed.scheme or not parsed.netloc:
+        return ""
+    return "%s://%s" % (parsed.scheme.lower(), parsed.netloc.lower())
+
+
+_allowed_origins = (None, frozenset())
+_allowed_origins_lock = threading.Lock()
+
+
+def allowed_origins():
+    """ allow_origin_sites() as a frozenset of origins. It only queries the
+    sites again after one of them changes. """
+    global _allowed_origins
+    version = get_version(SITES_VERSION_KEY)
+    with _allowed_origins_lock:
+        cached_version, origins = _allowed_origins
+    if cached_version != version:
+        origins = set()
+        for site in allow_origin_sites():
+            origin = origin_of(site)
+            if origin:
+                origins.add(origin)
+            else:
+                logging.warn("Ignoring %r, which isn't a CORS origin." % site)
+        origins = frozenset(origins)
+        with _allowed_origins_lock:
+            _allowed_origins = (version, origins)
+    return origins
+
+
 def api_response(request, data, callback=None, format='json'):
     # http://www.loggly.com/blog/2011/12/enabling-cors-in-django-piston/
     # for how to enable CORS
@@ -68,18 +134,23 @@ def api_response(request, data, callback=None, format='json'):
     else:
         response = HttpResponse(mimetype='application/json')
         dump(data, response)
+    return _add_cors_headers(request, response)
+
 
+def _add_cors_headers(request, response):
     origin = request.META.get('HTTP_REFERER', '') or \
              request.META.get('HTTP_ORIGIN', '')
-    allowed = allow_origin_sites()
+    allowed = allowed_origins()
     if origin:
-        allowed = [a for a in allowed if origin.find(a) >= 0]
-    response["Access-Control-Allow-Origin"] = " ".join(allowed)
+        origin = origin_of(origin)
+        allowed = [origin] if origin in allowed else []
+    response["Access-Control-Allow-Origin"] = " ".join(sorted(allowed))
     response['Access-Control-Allow-Methods'] = \
         'POST, GET, OPTIONS, HEAD, PUT, DELETE'
     response["Access-Control-Allow-Headers"] = 'Authorization'
     response["Access-Control-Allow-Credentials"] = 'true'
-
+    # Shared caches mustn't hand one site's allowed origin to another.
+    patch_vary_headers(response, ("Origin", "Referer"))
     return response
 
 
@@ -102,9 +173,9 @@ def api_response_decorator(format='json'):
 def _user_entered_survey(request, survey):
     if not get_user(request).is_authenticated():
         return False
-    return bool(survey.submissions_for(
+    return survey.submissions_for(
         get_user(request),
-        get_session(request).session_key.lower()).count())
+        get_session(request).session_key.lower()).exists()
 
 
 def _entered_no_more_allowed(request, survey):
@@ -170,16 +241,21 @@ def _submit_valid_forms(forms, request, survey):
     submission.is_public = not survey.moderate_submissions
     if get_user(request).is_authenticated():
         submission.user = get_user(request)
-    submission.save()
+    answers = []
     for form in forms[1:]:
         answer = form.save(commit=False)
         if isinstance(answer, (list, tuple)):
-            for a in answer:
-                a.submission = submission
-                a.save()
+            answers.extend(answer)
         elif answer:
-                answer.submission = submission
-                answer.save()
+            answers.append(answer)
+    with atomic():
+        submission.save()
+        for answer in answers:
+            answer.submission = submission
+        # bulk_create skips Answer.save, so process_new_answers below takes
+        # care of everything Answer.save would have done.
+        Answer.objects.bulk_create(answers)
+    process_new_answers(submission, answers)
     if survey.email:
         _send_survey_email(request, survey, submission)
     return True
@@ -343,9 +419,140 @@ def allowed_actions(request, slug):
         "need_login": survey.require_login and not authenticated}
 
 
+def _timestamp(dt):
+    return time.mktime(dt.timetuple())
+
+
+def _last_modified(survey, versions):
+    """ Versions are in milliseconds. Surveys opening and closing change what
+    people see too. """
+    now = datetime.now()
+    changes = [v / 1000.0 for v in versions]
+    changes.extend(_timestamp(dt) for dt in (survey.starts_at, survey.ends_at)
+                   if dt and dt <= now)
+    return max(changes)
+
+
+def _survey_validators(request, survey, *parts):
+    """ Returns (etag, last_modified, public) for a response that only
+    changes when the survey's results version does, i.e. when someone edits
+    its questions, submits to it, or moderates a submission. The ETag covers
+    the full path, so filters and callbacks get their own. Anonymous
+    responses are the same for everyone, so caches can share them. """
+    user = get_user(request)
+    authenticated = user.is_authenticated()
+    version = get_survey_version(survey.id)
+    etag = hashlib.md5(repr((survey.id,
+                             version,
+                             authenticated and user.id,
+                             bool(user.is_staff),
+                             request.get_full_path()) + parts)).hexdigest()
+    return etag, _last_modified(survey, [version]), not authenticated
+
+
+def _not_modified(request, validators):
+    """ Does the client already have this version of the response? An
+    If-None-Match header trumps If-Modified-Since. """
+    etag, last_modified, public = validators
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or "*" in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return bool(if_modified_since and int(last_modified) <= if_modified_since)
+
+
+def _set_validators(response, validators):
+    etag, last_modified, public = validators
+    response["ETag"] = '"%s"' % etag
+    response["Last-Modified"] = http_date(last_modified)
+    max_age = crowdsourcing_settings.API_CACHE_MAX_AGE
+    if public and max_age:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        # Make browsers check back each time. The check usually costs a 304.
+        patch_cache_control(response, private=not public,
+                            must_revalidate=True, max_age=0)
+    patch_vary_headers(response, ("Cookie",))
+    return response
+
+
+def _not_modified_response(validators):
+    return _set_validators(HttpResponseNotModified(), validators)
+
+
 @api_response_decorator()
 def questions(request, slug):
-    return _get_survey_or_404(slug, request).to_jsondata()
+    survey = _get_survey_or_404(slug, request)
+    validators = _survey_validators(request, survey)
+    if _not_modified(request, validators):
+        return _add_cors_headers(request, _not_modified_response(validators))
+    callback = request.GET.get('callback', None)
+    response = api_response(request, survey.to_jsondata(), callback=callback)
+    return _set_validators(response, validators)
+
+
+def _poll_results(request, survey, is_staff):
+    """ Pie chart style counts for the survey's choice questions. """
+    OTC = OPTION_TYPE_CHOICES
+    types = (OTC.BOOL,
+             OTC.CHOICE,
+             OTC.SELECT,
+             OTC.NUMERIC_CHOICE,
+             OTC.NUMERIC_SELECT)
+    fields = survey.get_fields() if is_staff else survey.get_public_fields()
+    results = {}
+    for field in fields:
+        if field.option_type in types:
+            aggregate = AggregateResultCount(survey,
+                                             field,
+                                             request.GET,
+                                             is_staff=is_staff)
+            results[field.fieldname] = aggregate.answer_values
+    return results
+
+
+def bootstrap(request, slug):
+    """ Everything an embedded survey needs in one request: what the user
+    can do, the questions, and with results=true the counts for the choice
+    questions. Answers 304 when nothing changed. """
+    if request.method.upper() == "OPTIONS":
+        return api_response(request, {})
+    survey = _get_survey_or_404(slug, request)
+    is_staff = get_user(request).is_staff
+    authenticated = get_user(request).is_authenticated()
+    actions = {
+        "enter": _can_show_form(request, survey),
+        "view": survey.can_have_public_submissions(),
+        "open": survey.is_open,
+        "need_login": survey.require_login and not authenticated}
+    include_results = request.GET.get("results", "").lower() == "true"
+    include_results = include_results and (actions["view"] or is_staff)
+    versions = [get_survey_version(survey.id, "schema")]
+    signature = ()
+    if include_results:
+        versions.append(get_survey_version(survey.id))
+        signature = filter_signature(survey, request.GET)
+    callback = request.GET.get('callback', None)
+    etag = hashlib.md5(repr((survey.id,
+                             versions,
+                             sorted(actions.items()),
+                             is_staff,
+                             include_results,
+                             signature,
+                             callback))).hexdigest()
+    # Only anonymous users all get the same allowed actions.
+    validators = (etag,
+                  _last_modified(survey, versions),
+                  not authenticated)
+    if _not_modified(request, validators):
+        return _add_cors_headers(request, _not_modified_response(validators))
+    data = {"allowed_actions": actions, "survey": survey.to_jsondata()}
+    if include_results:
+        data["results"] = _poll_results(request, survey, is_staff)
+    response = api_response(request, data, callback=callback)
+    return _set_validators(response, validators)
 
 
 def submissions(request, format):
@@ -385,6 +592,8 @@ def submissions(request, format):
     results = results.select_related("survey", "user")
     get = request.GET.copy()
     limit = int(get.pop("limit", [0])[0])
+    stream = get.pop("stream", [""])[0].lower()
+    stream = stream and not stream in ('f', 'false', 'no', 'n', '0',)
     keys = get.keys()
     basic_filters = (
         'survey',
@@ -458,14 +667,33 @@ def submissions(request, format):
     if not is_staff:
         if survey_slug:
             if not get_survey().can_have_public_submissions():
-                results = []
+                results = results.none()
         else:
             rs = [r for r in results if r.survey.can_have_public_submissions()]
             results = rs
+    validators = None
+    if survey_slug:
+        try:
+            validators = _survey_validators(request, get_survey(), format)
+        except Survey.DoesNotExist:
+            pass
+        if validators and _not_modified(request, validators):
+            return _not_modified_response(validators)
+    if stream and survey_slug and format in ('json', 'csv',):
+        if not validators:
+            # No such survey.
+            raise Http404
+        response = _stream_submissions(results, get_survey(), format,
+                                       is_staff, limit)
+        return _set_validators(response, validators)
     if limit:
         results = results[:limit]
-    answer_lookup = get_all_answers(results,
-                                    include_private_questions=is_staff)
+    if validators:
+        # validators means get_survey() found the survey.
+        answer_lookup = _export_answers(get_survey(), results, is_staff)
+    else:
+        answer_lookup = get_all_answers(results,
+                                        include_private_questions=is_staff)
     result_data = []
     for r in results:
         data = r.to_jsondata(answer_lookup, include_private_questions=is_staff)
@@ -521,9 +749,115 @@ def submissions(request, format):
         response = HttpResponse("\n".join(results))
     else:
         return HttpResponse("Unsure how to handle %s format" % format)
+    if validators:
+        _set_validators(response, validators)
     return response
 
 
+def _export_keys(survey, is_staff):
+    """ The column names of a survey's exported submissions, worked out
+    from its questions rather than from the submissions themselves. """
+    keys = ['featured', 'is_public', 'submitted_at', 'survey', 'user']
+    if is_staff:
+        keys.extend(BALLOT_STUFFING_FIELDS)
+        fields = survey.get_fields()
+    else:
+        fields = survey.get_public_fields()
+    for field in fields:
+        if field.option_type == OPTION_TYPE_CHOICES.BOOL_LIST:
+            # Submission.to_jsondata uses the checked options as keys.
+            keys.extend(field.option_values)
+        else:
+            keys.append(field.fieldname)
+    return sorted(set(keys))
+
+
+def _submission_chunks(results, limit):
+    """ Yields lists of submissions newest first. Each chunk picks up where
+    the last one left off by (submitted_at, id) rather than by OFFSET so
+    every chunk costs the same. """
+    chunk_size = crowdsourcing_settings.EXPORT_CHUNK_SIZE
+    results = results.order_by("-submitted_at", "-id")
+    last = None
+    remaining = limit
+    while True:
+        chunk = results
+        if last:
+            chunk = chunk.filter(
+                Q(submitted_at__lt=last.submitted_at) |
+                Q(submitted_at=last.submitted_at, id__lt=last.id))
+        if limit:
+            chunk = list(chunk[:min(chunk_size, remaining)])
+            remaining -= len(chunk)
+        else:
+            chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if limit and not remaining:
+            return
+        last = chunk[-1]
+
+
+def _export_answers(survey, results, is_staff, fields=None):
+    """ get_all_answers for a single survey's export, from its wide table if
+    it has one. """
+    if fields is None:
+        if is_staff:
+            fields = survey.get_fields()
+        else:
+            fields = survey.get_public_fields()
+    if wide.is_enabled(survey.id):
+        return wide.get_all_answers(survey.id, results, fields)
+    return get_all_answers(results,
+                           include_private_questions=is_staff,
+                           questions=fields)
+
+
+def _stream_submissions(results, survey, format, is_staff, limit):
+    if is_staff:
+        fields = survey.get_fields()
+    else:
+        fields = survey.get_public_fields()
+
+    def rows():
+        for chunk in _submission_chunks(results, limit):
+            answer_lookup = _export_answers(survey, chunk, is_staff, fields)
+            for r in chunk:
+                data = r.to_jsondata(answer_lookup,
+                                     include_private_questions=is_staff)
+                data.update(data.pop("data"))
+                yield data
+
+    if format == 'json':
+        def content():
+            yield "["
+            separator = ""
+            for data in rows():
+                yield separator + dumps(data)
+                separator = ",\n"
+            yield "]"
+        content_type = 'application/json'
+    else:
+        class Echo(object):
+            """ csv.writer writes to this and we yield what it wrote. """
+            def write(self, value):
+                return value
+
+        def content():
+            writer = csv.writer(Echo())
+            keys = _export_keys(survey, is_staff)
+            yield writer.writerow(keys)
+            for data in rows():
+                row = []
+                for k in keys:
+                    value = u"%s" % _encode(data.get(k, ""))
+                    row.append(value.encode("utf-8"))
+                yield writer.writerow(row)
+        content_type = 'text/csv'
+    return StreamingHttpResponse(content(), content_type=content_type)
+
+
 def _encode(possible):
     if possible is True:
         return 1
@@ -586,10 +920,27 @@ def survey_report(request, slug, report='', page=None):
 def embeded_survey_report(request, slug, report=''):
     templates = ['crowdsourcing/embeded_survey_report_%s.html' % slug,
                  'crowdsourcing/embeded_survey_report.html']
-    return _survey_report(request, slug, report, None, templates)
+    survey = _get_survey_or_404(slug, request)
+    validators = None
+    # The pre report hook can sort on something outside the survey, such as
+    # ratings, so the survey's version doesn't tell us when the report
+    # changes.
+    if not crowdsourcing_settings.PRE_REPORT:
+        validators = _survey_validators(request, survey, report)
+        if _not_modified(request, validators):
+            response = _not_modified_response(validators)
+            return _add_cors_headers(request, response)
+    result = _survey_report(request, slug, report, None, templates, survey)
+    if isinstance(result, HttpResponse):
+        return result
+    callback = request.GET.get('callback', None)
+    response = api_response(request, result, callback=callback, format='html')
+    if validators:
+        return _set_validators(response, validators)
+    return response
 
 
-def _survey_report(request, slug, report, page, templates):
+def _survey_report(request, slug, report, page, templates, survey=None):
     """ Show a report for the survey. As rating is done in a separate
     application we don't directly check request.GET["sort"] here.
     crowdsourcing_settings.PRE_REPORT is the place for that. """
@@ -601,7 +952,8 @@ def _survey_report(request, slug, report, page, templates):
             page = int(page)
         except ValueError:
             raise Http404
-    survey = _get_survey_or_404(slug, request)
+    if survey is None:
+        survey = _get_survey_or_404(slug, request)
     # is the survey anything we can actually have a report on?
     is_public = survey.is_live and survey.can_have_public_submissions()
     if not is_public and not is_staff:
@@ -616,6 +968,18 @@ def _survey_report(request, slug, report, page, templates):
     else:
         report_obj = _default_report(survey, is_staff)
 
+    cache_key = None
+    if crowdsourcing_settings.REPORT_CACHE_TIMEOUT:
+        cache_key = _report_cache_key(request,
+                                      survey,
+                                      report,
+                                      page,
+                                      templates,
+                                      is_staff)
+        html = cache.get(cache_key, None)
+        if html is not None:
+            return html
+
     if is_staff:
         archive_fields = list(survey.get_archive_fields())
         submissions = survey.submission_set.all()
@@ -624,16 +988,26 @@ def _survey_report(request, slug, report, page, templates):
         archive_fields = list(survey.get_public_archive_fields())
         submissions = survey.public_submissions()
         fields = list(survey.get_public_fields())
-    filters = get_filters(survey, request.GET)
+    # Every display and template tag on the page shares this.
+    report_context = ReportContext.get(survey, request.GET)
+    report_context.plan(report_obj)
+    filters = report_context.filters
 
     id_field = "crowdsourcing_submission.id"
+    count = None
     if not report_obj.display_individual_results:
         submissions = submissions.none()
     else:
-        submissions = extra_from_filters(submissions,
-                                         id_field,
-                                         survey,
-                                         request.GET)
+        unfiltered = not any((report_context.signature,
+                              crowdsourcing_settings.PRE_REPORT,
+                              report_obj.featured))
+        if unfiltered and is_staff:
+            count = survey.submission_count
+        elif unfiltered and survey.can_have_public_submissions():
+            count = survey.public_submission_count
+        if count is not None and report_obj.limit_results_to:
+            count = min(count, report_obj.limit_results_to)
+        submissions = report_context.compiled.apply(submissions, id_field)
         # If you want to sort based on rating, wire it up here.
         if crowdsourcing_settings.PRE_REPORT:
             pre_report = get_function(crowdsourcing_settings.PRE_REPORT)
@@ -645,7 +1019,17 @@ def _survey_report(request, slug, report, page, templates):
             submissions = submissions.filter(featured=True)
         if report_obj.limit_results_to:
             submissions = submissions[:report_obj.limit_results_to]
-    paginator, page_obj = paginate_or_404(submissions, page)
+    keyset = all((crowdsourcing_settings.KEYSET_PAGINATION,
+                  report_obj.display_individual_results,
+                  not crowdsourcing_settings.PRE_REPORT,
+                  not report_obj.limit_results_to))
+    if keyset:
+        paginator, page_obj = keyset_paginate_or_404(submissions,
+                                                     page,
+                                                     request.GET,
+                                                     count=count)
+    else:
+        paginator, page_obj = paginate_or_404(submissions, page, count=count)
 
     page_answers = get_all_answers(
         page_obj.object_list,
@@ -672,7 +1056,30 @@ def _survey_report(request, slug, report, page, templates):
         request=request,
         is_staff=get_user(request).is_staff)
 
-    return render_to_string(templates, context, _rc(request))
+    html = render_to_string(templates, context, _rc(request))
+    if cache_key:
+        timeout = crowdsourcing_settings.REPORT_CACHE_TIMEOUT
+        cache.set(cache_key, html, timeout)
+    return html
+
+
+def _report_cache_key(request, survey, report, page, templates, is_staff):
+    query = filter_signature(survey, request.GET)
+    if crowdsourcing_settings.PRE_REPORT:
+        # The pre report hook can sort on anything in the query string.
+        query = sorted(request.GET.lists())
+    # A page reached through a keyset cursor isn't necessarily the page
+    # with that number reached by OFFSET.
+    cursor = (request.GET.get("after", ""), request.GET.get("before", ""))
+    return make_key("report",
+                    survey.id,
+                    get_survey_version(survey.id),
+                    report,
+                    page,
+                    templates[0],
+                    bool(is_staff),
+                    query,
+                    cursor)
 
 
 def pages_to_link_from_paginator(page, paginator):
@@ -700,14 +1107,29 @@ def pages_to_link_from_paginator(page, paginator):
     return [p for p in pages if p != DISCARD]
 
 
-def paginate_or_404(queryset, page, num_per_page=20):
+class CountedPaginator(Paginator):
+    """ A Paginator that takes the count, when it's already known, rather
+    than counting. """
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.known_count = count
+
+    def _get_count(self):
+        if self.known_count is not None:
+            return self.known_count
+        return super(CountedPaginator, self)._get_count()
+    count = property(_get_count)
+
+
+def paginate_or_404(queryset, page, num_per_page=20, count=None):
     """
     paginate a queryset (or other iterator) for the given page, returning the
-    paginator and page object. Raises a 404 for an invalid page.
+    paginator and page object. Raises a 404 for an invalid page. If you
+    already know how many items there are, pass count to skip counting them.
     """
     if page is None:
         page = 1
-    paginator = Paginator(queryset, num_per_page)
+    paginator = CountedPaginator(queryset, num_per_page, count=count)
     try:
         page_obj = paginator.page(page)
     except EmptyPage, InvalidPage:
@@ -715,6 +1137,104 @@ def paginate_or_404(queryset, page, num_per_page=20):
     return paginator, page_obj
 
 
+CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(submission):
+    """ An opaque, url safe bookmark for a submission's place in the
+    report. """
+    raw = "%s|%d" % (submission.submitted_at.strftime(CURSOR_DATE_FORMAT),
+                     submission.id)
+    return urlsafe_b64encode(raw).rstrip("=")
+
+
+def decode_cursor(cursor):
+    """ Returns (submitted_at, id), or None if cursor is garbage. """
+    try:
+        raw = urlsafe_b64decode(str(cursor) + "=" * (-len(cursor) % 4))
+        submitted_at, id = raw.split("|")
+        return datetime.strptime(submitted_at, CURSOR_DATE_FORMAT), int(id)
+    except (TypeError, ValueError, UnicodeError):
+        return None
+
+
+class KeysetPage(object):
+    """ Stands in for django.core.paginator.Page. Rather than an OFFSET, the
+    page starts just after or just before a cursor, so page 5000 costs the
+    same as page 1. """
+    def __init__(self, object_list, number, paginator, has_next):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self.next_cursor = self.previous_cursor = None
+        if object_list:
+            self.next_cursor = encode_cursor(object_list[-1])
+            self.previous_cursor = encode_cursor(object_list[0])
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return '<Page %s of %s>' % (self.number, self.paginator.num_pages)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+def keyset_paginate_or_404(queryset, page, query, num_per_page=20, count=None):
+    """ Like paginate_or_404 but for submissions, newest first. With an
+    "after" or "before" cursor in the query it seeks straight to the page.
+    Without one, say for a link to page 7 out of the blue, it falls back to an
+    OFFSET. """
+    if page is None:
+        page = 1
+    paginator = CountedPaginator(queryset, num_per_page, count=count)
+    after = query.get("after", "")
+    before = query.get("before", "")
+    if not (after or before) or page == 1:
+        paginator.object_list = queryset.order_by("-submitted_at", "-id")
+        try:
+            page_obj = paginator.page(page)
+        except (EmptyPage, InvalidPage):
+            raise Http404
+        return paginator, KeysetPage(list(page_obj.object_list),
+                                     page_obj.number,
+                                     paginator,
+                                     page_obj.has_next())
+    submitted_at, id = decode_cursor(after or before) or (None, None)
+    if not submitted_at:
+        raise Http404
+    if after:
+        seek = (Q(submitted_at__lt=submitted_at) |
+                Q(submitted_at=submitted_at, id__lt=id))
+        found = queryset.filter(seek).order_by("-submitted_at", "-id")
+        found = list(found[:num_per_page + 1])
+        has_next = len(found) > num_per_page
+        found = found[:num_per_page]
+    else:
+        seek = (Q(submitted_at__gt=submitted_at) |
+                Q(submitted_at=submitted_at, id__gt=id))
+        found = queryset.filter(seek).order_by("submitted_at", "id")
+        found = list(reversed(found[:num_per_page]))
+        has_next = True
+    if not found:
+        raise Http404
+    return paginator, KeysetPage(found, page, paginator, has_next)
+
+
 def location_question_results(
     request,
     question_id,
@@ -726,6 +1246,9 @@ def location_question_results(
     is_staff = get_user(request).is_staff
     if not question.survey.can_have_public_submissions() and not is_staff:
         raise Http404
+    validators = _survey_validators(request, question.survey)
+    if _not_modified(request, validators):
+        return _not_modified_response(validators)
     featured = limit_results_to = False
     if survey_report_slug:
         survey_report = get_object_or_404(SurveyReport.objects,
@@ -775,7 +1298,49 @@ def location_question_results(
         entries.append(d)
     response = HttpResponse(mimetype='application/json')
     dump({"entries": entries}, response)
-    return response
+    return _set_validators(response, validators)
+
+
+def slideshow_slides(request, slug, display_id, question_id):
+    """ The slides simple_slideshow loads as people page through a
+    slideshow. GET start and count pick the window, and any filters on the
+    report apply. """
+    survey = _get_survey_or_404(slug, request)
+    is_staff = get_user(request).is_staff
+    if not survey.can_have_public_submissions() and not is_staff:
+        raise Http404
+    display = get_object_or_404(
+        SurveyReportDisplay.objects.select_related("report__survey"),
+        pk=display_id,
+        report__survey=survey)
+    question = get_object_or_404(Question.objects,
+                                 pk=question_id,
+                                 survey=survey,
+                                 option_type=OPTION_TYPE_CHOICES.PHOTO)
+    if not question.answer_is_public and not is_staff:
+        raise Http404
+    try:
+        start = max(0, int(request.GET.get("start", 0)))
+        count = int(request.GET.get("count", 0))
+    except ValueError:
+        raise Http404
+    # Don't let one request page through the whole survey.
+    limit = max(crowdsourcing_settings.SLIDESHOW_PAGE_SIZE, 20)
+    count = min(max(count, 1), limit)
+    validators = _survey_validators(request, survey)
+    if _not_modified(request, validators):
+        return _not_modified_response(validators)
+    # The template tag library imports this module.
+    from .templatetags.crowdsourcing import slide
+    answers = display.slide_answers(question, request.GET, is_staff)
+    answers = list(answers[start:start + count])
+    captions = display.slide_captions(answers)
+    slides = [slide(answer, captions) for answer in answers]
+    response = api_response(request,
+                            {"start": start, "slides": slides},
+                            callback=request.GET.get("callback", None))
+    return _set_validators(response, validators)
+
 
 def location_question_map(
     request,
@@ -0,0 +1,419 @@
+"""
+An optional wide table per survey, crowdsourcing_wide_<survey id>, with one
+row per submission and one typed column per question. Exports, filters and
+2-axis charts read it directly rather than joining crowdsourcing_answer to
+itself once per question. Turn it on with Survey.use_wide_table.
+Crowdsourcing keeps the table up to date as people submit and staff edit.
+Building it from scratch takes a while, so requests never do. Surveys wait
+in the "missing" state until ./manage.py rebuild_wide_tables or the
+BuildWideTables task gets to them, and read from crowdsourcing_answer in
+the meantime.
+
+A question's columns are named q<question id>_<crowdsourcing_answer column>,
+for example q12_integer_answer, plus q12_latitude and q12_longitude for
+location questions. Checkbox list questions have one answer per checked
+option, so their column holds the checked options one per line. Filters and
+charts on them go through crowdsourcing_answer as usual.
+"""
+from __future__ import absolute_import
+
+from itertools import islice
+import threading
+
+from django.db import connection, models, transaction
+
+from .caching import (WIDE_TABLES_VERSION_KEY, bump_survey_version,
+                      bump_version, get_version)
+from .util import ChoiceEnum
+from . import settings as local_settings
+
+
+# missing: there's no table we can use. Nothing reads or writes it.
+# creating: rebuild claimed the survey and is creating the table.
+# filling: new submissions and edits write to the table while rebuild fills
+# it in for older submissions. Nothing reads it yet.
+# ready: everything reads and writes it.
+STATES = ChoiceEnum("missing creating filling ready")
+
+
+_FIXED_COLUMNS = (("submission_id", models.IntegerField()),
+                  ("is_public", models.BooleanField()),
+                  ("featured", models.BooleanField()),
+                  ("submitted_at", models.DateTimeField()))
+
+
+_ANSWER_FIELDS = dict(text_answer=models.TextField(),
+                      integer_answer=models.IntegerField(),
+                      float_answer=models.FloatField(),
+                      boolean_answer=models.NullBooleanField(),
+                      image_answer=models.CharField(max_length=500),
+                      latitude=models.FloatField(),
+                      longitude=models.FloatField())
+
+
+def table_name(survey_id):
+    return "crowdsourcing_wide_%d" % survey_id
+
+
+def column_name(question, answer_column=None):
+    return "q%d_%s" % (question.id, answer_column or question.value_column)
+
+
+def answer_columns(question):
+    """ The crowdsourcing_answer columns question keeps in the wide table. """
+    from .models import OPTION_TYPE_CHOICES
+    columns = [question.value_column]
+    if OPTION_TYPE_CHOICES.LOCATION == question.option_type:
+        columns.extend(["latitude", "longitude"])
+    return columns
+
+
+def _is_list(question):
+    from .models import OPTION_TYPE_CHOICES
+    return OPTION_TYPE_CHOICES.BOOL_LIST == question.option_type
+
+
+def _questions(survey_id):
+    # models imports this module.
+    from .models import SurveySchema
+    return SurveySchema.for_survey(survey_id).questions
+
+
+_wide_survey_ids = (None, frozenset())
+_wide_survey_ids_lock = threading.Lock()
+
+
+def wide_survey_ids():
+    """ The ids of the surveys with use_wide_table checked, as a frozenset.
+    It only queries the surveys again after one of them turns its wide table
+    on or off or its table changes state, so sites that never use wide
+    tables pay a cache lookup rather than a query. """
+    global _wide_survey_ids
+    version = get_version(WIDE_TABLES_VERSION_KEY)
+    with _wide_survey_ids_lock:
+        cached_version, survey_ids = _wide_survey_ids
+    if cached_version != version:
+        from .models import Survey
+        surveys = Survey.objects.filter(use_wide_table=True)
+        survey_ids = frozenset(surveys.values_list("id", flat=True))
+        with _wide_survey_ids_lock:
+            _wide_survey_ids = (version, survey_ids)
+    return survey_ids
+
+
+def changed_wide_surveys():
+    """ Call this when a survey turns its wide table on or off. """
+    bump_version(WIDE_TABLES_VERSION_KEY)
+
+
+def _state(survey_id):
+    if survey_id not in wide_survey_ids():
+        return STATES.MISSING
+    from .models import Survey, SurveySchema
+    if local_settings.CACHE_SURVEY_SCHEMA:
+        return SurveySchema.for_survey(survey_id).wide_table_state
+    surveys = Survey.objects.filter(pk=survey_id, use_wide_table=True)
+    states = list(surveys.values_list("wide_table_state", flat=True))
+    return states[0] if states else STATES.MISSING
+
+
+def is_enabled(survey_id):
+    """ Whether queries can read the table. """
+    return STATES.READY == _state(survey_id)
+
+
+def is_maintained(survey_id):
+    """ Whether changes to the survey's submissions have to update the
+    table. """
+    return _state(survey_id) in (STATES.FILLING, STATES.READY)
+
+
+def _set_state(survey_id, state, **filters):
+    """ Returns whether the survey matched filters. """
+    from .models import Survey
+    surveys = Survey.objects.filter(pk=survey_id, **filters)
+    changed = surveys.update(wide_table_state=state)
+    if changed:
+        bump_survey_version(survey_id, "schema")
+        # So every process sees a survey it might have missed, in time to
+        # keep the table up to date while it fills.
+        changed_wide_surveys()
+    return bool(changed)
+
+
+def covers(survey_id, questions):
+    """ Whether a query on questions can run against the wide table. """
+    if not is_enabled(survey_id):
+        return False
+    return not any(_is_list(question) for question in questions)
+
+
+def _commit():
+    # Django 1.6 commits on its own, older versions need a nudge after raw
+    # SQL outside of a transaction.
+    if not hasattr(transaction, "atomic"):
+        transaction.commit_unless_managed()
+
+
+def _existing_columns(cursor, survey_id):
+    """ None if the table doesn't exist. """
+    name = table_name(survey_id)
+    if name not in connection.introspection.table_names():
+        return None
+    description = connection.introspection.get_table_description(cursor, name)
+    return set(row[0] for row in description)
+
+
+def _column_definitions(questions):
+    definitions = [(name, field.db_type(connection))
+                   for name, field in _FIXED_COLUMNS]
+    for question in questions:
+        for answer_column in answer_columns(question):
+            field = _ANSWER_FIELDS[answer_column]
+            definitions.append((column_name(question, answer_column),
+                                field.db_type(connection)))
+    return definitions
+
+
+def drop(survey_id):
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS " + table_name(survey_id))
+    _commit()
+
+
+def rebuild(survey_id, force=False):
+    """ Drop the table and build it again from crowdsourcing_answer. Only
+    builds surveys in the "missing" state, so that two builders never work on
+    the same table, unless you force it. Returns whether it built the table.
+    This reads every answer in the survey, so don't call it while handling a
+    request. """
+    filters = dict(use_wide_table=True)
+    if not force:
+        filters["wide_table_state"] = STATES.MISSING
+    if not _set_state(survey_id, STATES.CREATING, **filters):
+        return False
+    try:
+        _build(survey_id)
+    except:
+        _set_state(survey_id, STATES.MISSING)
+        raise
+    _set_state(survey_id, STATES.READY)
+    return True
+
+
+def _build(survey_id):
+    from .models import Submission
+    drop(survey_id)
+    definitions = _column_definitions(_questions(survey_id))
+    columns = ", ".join("%s %s" % pair for pair in definitions)
+    cursor = connection.cursor()
+    cursor.execute("".join(("CREATE TABLE ",
+                            table_name(survey_id),
+                            " (",
+                            columns,
+                            ", PRIMARY KEY (submission_id))")))
+    _commit()
+    # From here on, submissions and edits keep their own rows up to date.
+    _set_state(survey_id, STATES.FILLING)
+    submissions = Submission.objects.filter(survey__id=survey_id)
+    ids = iter(submissions.values_list("id", flat=True).order_by("id"))
+    chunk_size = local_settings.ANSWER_QUERY_CHUNK_SIZE
+    while True:
+        chunk = list(islice(ids, chunk_size))
+        if not chunk:
+            break
+        refresh(survey_id, chunk)
+    # Submissions that came in just as the table went up.
+    cursor.execute("".join((
+        "SELECT id FROM crowdsourcing_submission WHERE survey_id = %s ",
+        "AND id NOT IN (SELECT submission_id FROM ",
+        table_name(survey_id),
+        ")")), [survey_id])
+    missed = [row[0] for row in cursor.fetchall()]
+    if missed:
+        refresh(survey_id, missed)
+
+
+def build_missing():
+    """ Build the tables of the surveys waiting for one. Returns how many it
+    built. """
+    from .models import Survey
+    surveys = Survey.objects.filter(use_wide_table=True,
+                                    wide_table_state=STATES.MISSING)
+    built = 0
+    for survey_id in list(surveys.values_list("id", flat=True)):
+        if rebuild(survey_id):
+            built += 1
+    return built
+
+
+def check_columns(survey_id):
+    """ Call this after a survey's questions change. If the table lacks a
+    column the questions need, stop using it until the next rebuild, rather
+    than altering the table in the middle of a request. """
+    if not is_maintained(survey_id):
+        return
+    existing = _existing_columns(connection.cursor(), survey_id) or set()
+    for question in _questions(survey_id):
+        for answer_column in answer_columns(question):
+            if column_name(question, answer_column) not in existing:
+                _set_state(survey_id, STATES.MISSING)
+                return
+
+
+def delete(survey_id, submission_ids):
+    if not submission_ids:
+        return
+    cursor = connection.cursor()
+    cursor.execute("".join((
+        "DELETE FROM ",
+        table_name(survey_id),
+        " WHERE submission_id IN (",
+        ", ".join(["%s"] * len(submission_ids)),
+        ")")), list(submission_ids))
+    _commit()
+
+
+def _value(answer, answer_column):
+    value = getattr(answer, answer_column)
+    if "image_answer" == answer_column:
+        return value.name if value else ""
+    return value
+
+
+def refresh(survey_id, submission_ids):
+    """ Rewrite the rows for submission_ids from crowdsourcing_answer. """
+    from .models import Submission, iter_answers
+    submission_ids = list(submission_ids)
+    delete(survey_id, submission_ids)
+    questions = _questions(survey_id)
+    by_id = dict((q.id, q) for q in questions)
+    submissions = Submission.objects.filter(pk__in=submission_ids)
+    fixed = dict((row[0], row) for row in submissions.values_list(
+        "id", "is_public", "featured", "submitted_at"))
+    names = [name for name, field in _FIXED_COLUMNS]
+    for question in questions:
+        names.extend(column_name(question, c)
+                     for c in answer_columns(question))
+    rows = []
+    for submission_id, answers in iter_answers(fixed.keys(), True):
+        values = {}
+        for answer in answers:
+            question = by_id.get(answer.question_id)
+            if not question:
+                continue
+            if _is_list(question):
+                name = column_name(question)
+                checked = values.get(name)
+                value = _value(answer, "text_answer")
+                values[name] = checked + "\n" + value if checked else value
+                continue
+            for answer_column in answer_columns(question):
+                value = _value(answer, answer_column)
+                values[column_name(question, answer_column)] = value
+        row = list(fixed[submission_id])
+        row.extend(values.get(name) for name in names[len(row):])
+        rows.append(row)
+    if not rows:
+        return
+    cursor = connection.cursor()
+    cursor.executemany("".join((
+        "INSERT INTO ",
+        table_name(survey_id),
+        " (",
+        ", ".join(names),
+        ") VALUES (",
+        ", ".join(["%s"] * len(names)),
+        ")")), rows)
+    _commit()
+
+
+def get_all_answers(survey_id, submission_list, questions):
+    """ Like models.get_all_answers, from the wide table. The answers aren't
+    saved and only have the value columns filled in. """
+    from .models import Answer
+    submission_ids = [getattr(s, "id", s) for s in submission_list]
+    columns = []
+    for question in questions:
+        columns.extend((question, c) for c in answer_columns(question))
+    names = ", ".join(column_name(q, c) for q, c in columns)
+    page_answers = {}
+    chunk_size = local_settings.ANSWER_QUERY_CHUNK_SIZE
+    cursor = connection.cursor()
+    for start in range(0, len(submission_ids), chunk_size):
+        ids = submission_ids[start:start + chunk_size]
+        cursor.execute("".join((
+            "SELECT submission_id, ",
+            names,
+            " FROM ",
+            table_name(survey_id),
+            " WHERE submission_id IN (",
+            ", ".join(["%s"] * len(ids)),
+            ")")), ids)
+        for row in cursor.fetchall():
+            answers = {}
+            for (question, answer_column), value in zip(columns, row[1:]):
+                if value is None:
+                    continue
+                if _is_list(question):
+                    page_answers.setdefault(row[0], []).extend(
+                        Answer(submission_id=row[0],
+                               question=question,
+                               text_answer=option)
+                        for option in value.split("\n"))
+                    continue
+                answer = answers.get(question.id)
+                if answer is None:
+                    answer = Answer(submission_id=row[0], question=question)
+                    answers[question.id] = answer
+                    page_answers.setdefault(row[0], []).append(answer)
+                setattr(answer, answer_column, value)
+    return page_answers
+
+
+def filter_subquery(survey_id, conditions):
+    """ Turns the (where, params) conditions from models._filter_conditions
+    into one query on the wide table for the matching submission ids. """
+    wheres = []
+    params = []
+    for where, condition_params in conditions:
+        prefix = "w.q%d_" % condition_params[0]
+        wheres.append(where.replace("{a}.", prefix))
+        params.extend(condition_params[1:])
+    sql = "".join(("SELECT w.submission_id FROM ",
+                   table_name(survey_id),
+                   " w WHERE ",
+                   " AND ".join(wheres)))
+    return sql, params
+
+
+def aggregate_query(columns, x_axis, compiled, featured):
+    """ The wide table version of AggregateResult2Axis's single pass query.
+    columns holds (aggregate function, y axis) pairs. compiled is the
+    request's CompiledFilters. """
+    x_column = "w." + column_name(x_axis)
+    query = ["SELECT ", x_column, " AS x_value"]
+    y_columns = []
+    for aggregate_function, y_axis in columns:
+        y_column = "w." + column_name(y_axis)
+        if y_column not in y_columns:
+            y_columns.append(y_column)
+        if "boolean_answer" == y_axis.value_column:
+            y_column = "CAST(" + y_column + " AS int)"
+        query.extend([", ", aggregate_function, "(", y_column, ")"])
+    query.extend([
+        " FROM ",
+        table_name(x_axis.survey_id),
+        " w WHERE w.is_public = true AND ",
+        x_column,
+        " IS NOT NULL AND (",
+        " OR ".join(y + " IS NOT NULL" for y in y_columns),
+        ")"])
+    params = []
+    if featured:
+        query.append(" AND w.featured = true")
+    if compiled:
+        where, params = compiled.where("w.submission_id")
+        query.extend([" AND ", where])
+    query.extend([" GROUP BY ", x_column])
+    return "".join(query), params
@@ -55,79 +55,94 @@ function toggleComments(id) {
 
 function loadSurvey(slug, elementId) {
   $(document).ready(function() {
-    var url = "/crowdsourcing/" + slug + "/api/allowed_actions/";
+    /* One request for both the allowed actions and the questions. The server
+     * answers 304 if neither changed since the browser last asked. */
+    var url = "/crowdsourcing/" + slug + "/api/bootstrap/";
     $.getJSON(url, function(data, status) {
+      var actions = data["allowed_actions"];
       loadSurveyForm(slug,
                      elementId,
-                     !data["enter"],
-                     data["view"],
-                     data["open"],
-                     data["need_login"]);
+                     !actions["enter"],
+                     actions["view"],
+                     actions["open"],
+                     actions["need_login"],
+                     data["survey"]);
     });
   });
 }
 
-function loadSurveyForm(slug, elementId, cantEnter, canView, open, needLogin) {
-  var url = "/crowdsourcing/" + slug + "/api/questions/";
+function loadSurveyForm(slug, elementId, cantEnter, canView, open, needLogin,
+                        survey) {
+  if (survey) {
+    showSurveyForm(survey, slug, elementId, cantEnter, canView, open,
+                   needLogin);
+  } else {
+    var url = "/crowdsourcing/" + slug + "/api/questions/";
+    $.getJSON(url, function(survey, status) {
+      showSurveyForm(survey, slug, elementId, cantEnter, canView, open,
+                     needLogin);
+    });
+  }
+}
 
-  $.getJSON(url, function(survey, status) {
-    var isChoiceType = false;
-    var types = {choice: 0, select: 0, numeric_select: 0, numeric_choice: 0};
-    for (var type in types) {
-      isChoiceType = isChoiceType || survey.questions[0].option_type == type;
-    }
-    var isPoll = survey.questions.length == 1 && isChoiceType;
-    var wrapper = initializeWrapper(elementId, isPoll ? "poll" : "survey");
-    var beforeWrapper = function(text, element) {
-      if (text) {
-        wrapper.before(element.html(text));
-      }
-    };
-    beforeWrapper(survey.title, $("<h3/>"));
-    var description = survey.description || survey.tease;
-    if (description) {
-      beforeWrapper(description, $("<p/>").addClass("subtitle"));
-    }
-    var form = $("<form/>").attr("method", "POST");
-    form.attr("action", survey.submit_url);
-    form.addClass(isPoll ? "vote" : "survey").appendTo(wrapper);
-    tease = $('#' + elementId).parent().parent();
-    if (tease.attr('class') == 'tease') {
-      tease.children().eq(0).hide();
+function showSurveyForm(survey, slug, elementId, cantEnter, canView, open,
+                        needLogin) {
+  var isChoiceType = false;
+  var types = {choice: 0, select: 0, numeric_select: 0, numeric_choice: 0};
+  for (var type in types) {
+    isChoiceType = isChoiceType || survey.questions[0].option_type == type;
+  }
+  var isPoll = survey.questions.length == 1 && isChoiceType;
+  var wrapper = initializeWrapper(elementId, isPoll ? "poll" : "survey");
+  var beforeWrapper = function(text, element) {
+    if (text) {
+      wrapper.before(element.html(text));
     }
+  };
+  beforeWrapper(survey.title, $("<h3/>"));
+  var description = survey.description || survey.tease;
+  if (description) {
+    beforeWrapper(description, $("<p/>").addClass("subtitle"));
+  }
+  var form = $("<form/>").attr("method", "POST");
+  form.attr("action", survey.submit_url);
+  form.addClass(isPoll ? "vote" : "survey").appendTo(wrapper);
+  tease = $('#' + elementId).parent().parent();
+  if (tease.attr('class') == 'tease') {
+    tease.children().eq(0).hide();
+  }
 
-    var div = $("<div/>").attr("id", "inner_" + slug).appendTo(form);
-    if (cantEnter) {
-      // I didn't use if (needLogin) or if (open) for backwards compatibility.
-      if (needLogin == true) {
-        div.text("You must login to enter this survey.");
-      } else if (open == true) {
-        div.text("You've already entered this survey.");
-      } else {
-        div.text("This survey isn't open yet.");
-      }
+  var div = $("<div/>").attr("id", "inner_" + slug).appendTo(form);
+  if (cantEnter) {
+    // I didn't use if (needLogin) or if (open) for backwards compatibility.
+    if (needLogin == true) {
+      div.text("You must login to enter this survey.");
+    } else if (open == true) {
+      div.text("You've already entered this survey.");
     } else {
-      if (isPoll) {
-        var question = survey.questions[0];
-        $("<h2/>").html(question.question).appendTo(div);
-        appendChoiceButtons(survey, question, div);
-      } else {
-        $.get(survey.submit_url, queryParametersAsLookup(), function(results, textStatus) {
-          var err = "Crowdsourcing encountered and error. Sorry about that!";
-          form.html("success" == textStatus ? results : err);
-        });
-      }
+      div.text("This survey isn't open yet.");
     }
-    form.ajaxForm({beforeSubmit: function() {
-      form.find("input[type='submit']").attr("value", "Submitting...").attr("disabled", true);
-      return true;
-    }, success: function(responseText) {
-      form.html(responseText);
-    }});
-    if (canView) {
-      appendSeeResults(wrapper, survey);
+  } else {
+    if (isPoll) {
+      var question = survey.questions[0];
+      $("<h2/>").html(question.question).appendTo(div);
+      appendChoiceButtons(survey, question, div);
+    } else {
+      $.get(survey.submit_url, queryParametersAsLookup(), function(results, textStatus) {
+        var err = "Crowdsourcing encountered and error. Sorry about that!";
+        form.html("success" == textStatus ? results : err);
+      });
     }
-  });
+  }
+  form.ajaxForm({beforeSubmit: function() {
+    form.find("input[type='submit']").attr("value", "Submitting...").attr("disabled", true);
+    return true;
+  }, success: function(responseText) {
+    form.html(responseText);
+  }});
+  if (canView) {
+    appendSeeResults(wrapper, survey);
+  }
 }
 
 function loadSurveyResults(surveySlug, reportSlug, elementId) {
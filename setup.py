@@ -15,13 +15,17 @@ classifiers = [
 
 
 setup(name='django-crowdsourcing',
-      version='1.1.50',
+      version='1.1.51',
       classifiers=classifiers,
       description='Django app for collecting and displaying surveys.',
       long_description=long_description,
       author='Jacob Smullyan, Dave Smith',
       author_email='jsmullyan@gmail.com',
       url='http://code.google.com/p/django-crowdsourcing/',
-      packages=['crowdsourcing', 'crowdsourcing.templatetags'],
+      packages=['crowdsourcing',
+                'crowdsourcing.management',
+                'crowdsourcing.management.commands',
+                'crowdsourcing.templatetags'],
+      package_data={'crowdsourcing': ['sql/*.sql']},
       license='MIT',
      )